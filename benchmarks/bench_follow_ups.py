@@ -0,0 +1,96 @@
+# Benchmark: memory and CPU of outstanding follow-ups, timing wheel vs. one
+# repeating JobQueue job per reminder.
+#
+# Usage: python benchmarks/bench_follow_ups.py [outstanding]
+# When python-telegram-bot is installed, the real JobQueue is measured on a
+# slice of the reminders and extrapolated.
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from followups import FollowUpWheel, FOLLOW_UP_SLOT
+
+FOLLOW_UP_INTERVAL = 1800
+JOBQUEUE_SAMPLE = 50000
+
+
+def measure(label, build, tick=None, count=None):
+    count = count or len(DUE)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = build(DUE[:count])
+    build_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    line = (f"{label:<24} {count:>8} reminders: build {build_time:7.2f}s | {memory / 2 ** 20:8.1f} MiB "
+            f"({memory / count:6.1f} B/reminder, ~{memory / count * len(DUE) / 2 ** 20:.0f} MiB at {len(DUE)})")
+    if tick is not None:
+        start = time.perf_counter()
+        handled = tick(state)
+        line += f" | first slot: {handled} follow-ups in {(time.perf_counter() - start) * 1000:.1f} ms"
+    print(line)
+    return state
+
+
+def wheel_build(due):
+    wheel = FollowUpWheel(now=NOW)
+    for reminder_id, at in due:
+        wheel.add(reminder_id, at)
+    return wheel
+
+
+# Pop one slot and put every follow-up back one interval later, as send_follow_ups does
+def wheel_tick(wheel):
+    now = NOW + FOLLOW_UP_SLOT
+    due = wheel.pop_due(now)
+    for reminder_id in due:
+        wheel.add(reminder_id, now + FOLLOW_UP_INTERVAL)
+    return len(due)
+
+
+def jobqueue_build(due):
+    from telegram.ext import Application
+
+    async def follow_up(context):
+        pass
+
+    # The application is never started; it only owns the job queue, whose
+    # scheduler runs paused so jobs land in its job store. AsyncIOScheduler
+    # needs a running event loop to start.
+    async def add_jobs():
+        job_queue = Application.builder().token('123456:offline').build().job_queue
+        job_queue.scheduler.start(paused=True)
+        for reminder_id, at in due:
+            job_data = {'chat_id': reminder_id % 50000, 'reminder_id': reminder_id, 'text': f"reminder {reminder_id}"}
+            job_queue.run_repeating(follow_up, interval=FOLLOW_UP_INTERVAL, first=at - NOW,
+                                    data=job_data, name=f"reminder_{reminder_id}")
+        return job_queue
+
+    return asyncio.run(add_jobs())
+
+
+if __name__ == '__main__':
+    outstanding = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    NOW = time.time() // FOLLOW_UP_SLOT * FOLLOW_UP_SLOT
+    rng = random.Random(1)
+    DUE = [(reminder_id, NOW + rng.uniform(0, FOLLOW_UP_INTERVAL)) for reminder_id in range(1, outstanding + 1)]
+
+    wheel = measure("timing wheel", wheel_build, wheel_tick)
+    print(f"{'':<24} {wheel.slot_count()} slots of {FOLLOW_UP_SLOT}s")
+    del wheel
+
+    try:
+        import telegram.ext  # noqa: F401
+    except ImportError:
+        print("python-telegram-bot not installed, skipping the per-reminder JobQueue measurement")
+    else:
+        # Adding jobs to APScheduler is slow, so measure a slice and extrapolate
+        measure("JobQueue run_repeating", jobqueue_build, count=min(len(DUE), JOBQUEUE_SAMPLE))
@@ -0,0 +1,66 @@
+# Benchmark: cost of the always-on instrumentation.
+#
+# Measures one histogram observation, the timed() wrapper around a handler
+# coroutine, and rendering /metrics with every series the bot registers.
+# Usage: python benchmarks/bench_metrics.py [iterations]
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import metrics
+
+
+def per_call(label, seconds, calls):
+    print(f"{label:<34} {seconds / calls * 1e9:8.0f} ns/call")
+
+
+async def noop(update, context):
+    pass
+
+
+async def run_handlers(handler, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        await handler(None, None)
+    return time.perf_counter() - start
+
+
+def main(calls):
+    registry = metrics.Registry()
+    histogram = registry.histogram('bench_seconds', "Benchmark histogram", ['handler'])
+    series = histogram.labels('noop')
+
+    start = time.perf_counter()
+    for i in range(calls):
+        series.observe(i * 1e-6)
+    per_call("Histogram observe", time.perf_counter() - start, calls)
+
+    start = time.perf_counter()
+    for i in range(calls):
+        histogram.labels('noop').observe(i * 1e-6)
+    per_call("labels() + observe", time.perf_counter() - start, calls)
+
+    plain = asyncio.run(run_handlers(noop, calls))
+    timed = asyncio.run(run_handlers(metrics.timed(histogram, 'noop')(noop), calls))
+    per_call("handler call, plain", plain, calls)
+    per_call("handler call, timed", timed, calls)
+    per_call("timed() overhead", timed - plain, calls)
+
+    # Roughly what the bot exposes: ~35 labelled histograms plus a dozen gauges
+    for i in range(35):
+        histogram.labels(f'handler_{i}').observe(0.01)
+    for i in range(12):
+        registry.gauge(f'bench_gauge_{i}', "Benchmark gauge", func=lambda: 1)
+    renders = 200
+    start = time.perf_counter()
+    for _ in range(renders):
+        text = registry.render()
+    print(f"{'render /metrics':<34} {(time.perf_counter() - start) / renders * 1e6:8.0f} us/scrape "
+          f"({len(text)} bytes)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,103 @@
+# Benchmark: daily reminders stored once with a repeat rule vs. one row per occurrence.
+#
+# Every user has one daily reminder. The "rows" setup stores each occurrence
+# for the next HORIZON_DAYS days as its own reminder, as users had to before
+# repeat rules; the "repeat" setup stores one row per user and moves it to the
+# next occurrence when it fires. Reports database size, startup heap load and
+# the cost of one simulated day of 2-second scheduler ticks, firings included.
+# Usage: python benchmarks/bench_recurring.py [users ...]
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage
+from migrations import ensure_reminders_schema
+from recurrence import next_occurrence
+from scheduler import DueHeap
+
+HORIZON_DAYS = 365
+LOOKAHEAD = 1800
+TICK = 2
+DAY = 86400
+
+
+def build_db(path, users, materialize):
+    conn = storage.connect(path)
+    ensure_reminders_schema(conn)
+    rng = random.Random(42)
+    start = int(time.time()) + 60
+
+    def rows():
+        for chat_id in range(1, users + 1):
+            first = start + rng.randrange(DAY)
+            if materialize:
+                for day in range(HORIZON_DAYS):
+                    yield chat_id, f"daily reminder {chat_id}", first + day * DAY, None
+            else:
+                yield chat_id, f"daily reminder {chat_id}", first, 'daily'
+
+    with conn:
+        conn.executemany(storage.SQL_INSERT_REPEATING_REMINDER, rows())
+    return conn, start
+
+
+def db_size(conn):
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+# One scheduler tick: pop what is due, fetch it, record the firing
+def tick(conn, heap, now):
+    fired = 0
+    for reminder_id, due in heap.pop_due(now + LOOKAHEAD):
+        row = conn.execute(storage.SQL_SELECT_REMINDER, (reminder_id,)).fetchone()
+        if row is None:
+            continue
+        chat_id, text, repeat = row
+        if repeat:
+            next_due_at = next_occurrence(repeat, due, int(now))
+            conn.execute(storage.SQL_ADVANCE_REPEATING, (next_due_at, None, now, reminder_id))
+            heap.push(reminder_id, next_due_at)
+        else:
+            conn.execute(storage.SQL_MARK_FIRED, (None, now, reminder_id))
+        fired += 1
+    conn.commit()
+    return fired
+
+
+def run(label, users, materialize):
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        conn, now = build_db(os.path.join(tmp, 'reminders.db'), users, materialize)
+        build_time = time.perf_counter() - start
+        rows = conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]
+        size = db_size(conn)
+
+        start = time.perf_counter()
+        heap = DueHeap()
+        heap.load(conn.execute(storage.SQL_SELECT_DUE_INDEX))
+        load_time = time.perf_counter() - start
+
+        ticks = DAY // TICK
+        fired = 0
+        start = time.perf_counter()
+        for i in range(ticks):
+            fired += tick(conn, heap, now + i * TICK)
+        tick_time = time.perf_counter() - start
+        conn.close()
+
+    print(f"{label:<6} {users:>6} users | {rows:>8} rows {size / 2 ** 20:8.1f} MiB (build {build_time:6.2f}s) "
+          f"| heap load {load_time * 1000:8.1f} ms, {len(heap):>8} entries "
+          f"| 1 day of ticks {tick_time:6.2f}s ({tick_time / ticks * 1e6:6.1f} us/tick), {fired} fired")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000]
+    for users in sizes:
+        run("rows", users, materialize=True)
+        run("repeat", users, materialize=False)
@@ -0,0 +1,189 @@
+# Benchmark: per-update dispatch overhead, old handler chain vs. the router.
+#
+# Both setups run through python-telegram-bot's own process_update with handler
+# bodies that do nothing, so only the routing cost is measured. The "chain"
+# setup mirrors the old registration order and button_handler's if/elif
+# parsing; the "router" setup is the one build_application() uses now.
+# Usage: python benchmarks/bench_router.py [updates]
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+
+from fake_bot_api import FakeBotAPI, chat, user
+from conversations import ConversationStore
+from router import Router, encode_callback
+
+# Share of each button in the callback traffic: mostly Done on reminders and
+# follow-ups, then listing navigation
+CALLBACK_MIX = [
+    ('done', 0.55),
+    ('page', 0.15),
+    ('my_reminders', 0.10),
+    ('delete', 0.08),
+    ('press_button', 0.08),
+    ('restart', 0.02),
+    ('remove_channel', 0.02),
+]
+# Share of text messages among all updates, and their conversation states
+TEXT_SHARE = 0.3
+TEXT_STATES = [(None, 0.1), ('reminder_text', 0.45), ('reminder_date', 0.45)]
+
+OLD_CALLBACK_DATA = {
+    'done': lambda rng: f'done_{rng.randrange(1, 10 ** 6)}',
+    'page': lambda rng: f'page_l_next_{rng.randrange(1, 2 ** 31)}_{rng.randrange(1, 10 ** 6)}',
+    'my_reminders': lambda rng: 'my_reminders',
+    'delete': lambda rng: f'delete_{rng.randrange(1, 10 ** 6)}',
+    'press_button': lambda rng: 'press_button',
+    'restart': lambda rng: 'restart',
+    'remove_channel': lambda rng: f'remove_channel_{rng.randrange(1, 100)}',
+}
+NEW_CALLBACK_DATA = {
+    'done': lambda rng: encode_callback('d', rng.randrange(1, 10 ** 6)),
+    'page': lambda rng: encode_callback('p', 'l', 'n', rng.randrange(1, 2 ** 31), rng.randrange(1, 10 ** 6)),
+    'my_reminders': lambda rng: encode_callback('m'),
+    'delete': lambda rng: encode_callback('x', rng.randrange(1, 10 ** 6)),
+    'press_button': lambda rng: encode_callback('s'),
+    'restart': lambda rng: encode_callback('r'),
+    'remove_channel': lambda rng: encode_callback('c', rng.randrange(1, 100)),
+}
+
+
+def pick(rng, weighted):
+    return rng.choices([value for value, _ in weighted], [weight for _, weight in weighted])[0]
+
+
+# Updates as (kind, payload, conversation state); turned into Update objects per setup
+def workload(count):
+    rng = random.Random(11)
+    items = []
+    for _ in range(count):
+        if rng.random() < TEXT_SHARE:
+            items.append(('text', 'some text', pick(rng, TEXT_STATES)))
+        else:
+            items.append(('callback', pick(rng, CALLBACK_MIX), None))
+    return items
+
+
+def make_updates(bot, items, callback_data):
+    rng = random.Random(3)
+    updates = []
+    for update_id, (kind, payload, state) in enumerate(items, 1):
+        user_id = rng.randrange(1, 10 ** 6)
+        message = {'message_id': update_id, 'date': 0, 'chat': chat(user_id), 'from': user(user_id)}
+        if kind == 'text':
+            update = {'update_id': update_id, 'message': dict(message, text=payload)}
+        else:
+            update = {'update_id': update_id, 'callback_query': {
+                'id': str(update_id), 'from': user(user_id), 'chat_instance': str(user_id),
+                'data': callback_data[payload](rng), 'message': dict(message, text='menu')}}
+        updates.append((Update.de_json(update, bot), state))
+    return updates
+
+
+async def noop(update, context, *args):
+    pass
+
+
+# The handler registration and button parsing the bot used before the router
+def add_chain_handlers(application):
+    async def button_handler(update, context):
+        callback_data = update.callback_query.data.split('_')
+        action = callback_data[0]
+        if action == 'done' and len(callback_data) == 2:
+            await noop(update, context, int(callback_data[1]))
+        elif action == 'delete' and len(callback_data) == 2:
+            await noop(update, context, int(callback_data[1]))
+        elif action == 'page' and len(callback_data) == 5:
+            await noop(update, context, *callback_data[1:])
+        elif callback_data[0] == 'remove' and len(callback_data) == 3:
+            await noop(update, context, int(callback_data[2]))
+        elif action == 'press' and len(callback_data) == 2:
+            await noop(update, context)
+        elif action == 'my' and callback_data[1] == 'reminders':
+            await noop(update, context)
+        elif action == 'restart':
+            await noop(update, context)
+
+    async def handle_reminder_input(update, context):
+        if 'waiting_for_text' in context.user_data and context.user_data['waiting_for_text']:
+            await noop(update, context)
+        elif update.message.text.startswith('https://t.me/'):
+            await noop(update, context)
+        else:
+            await noop(update, context)
+
+    for command in ("start", "restart", "setreminder", "help"):
+        application.add_handler(CommandHandler(command, noop))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_reminder_input))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    for command in ("myreminders", "deletereminder"):
+        application.add_handler(CommandHandler(command, noop))
+    application.add_handler(CallbackQueryHandler(noop))
+    application.add_handler(CommandHandler("addchannel", noop))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, noop))
+    for command in ("removechannel", "stats"):
+        application.add_handler(CommandHandler(command, noop))
+    for _ in range(3):
+        application.add_handler(CallbackQueryHandler(noop))
+
+
+def add_router_handlers(application, conversations):
+    router = Router(conversations.state)
+    for code in 'dxpcsmr':
+        router.on_callback(code, noop)
+    router.fallback_callback(noop)
+    for state in ('channel_link', 'reminder_text', 'reminder_date'):
+        router.on_text(state, noop)
+    router.fallback_text(noop)
+
+    application.add_handler(CallbackQueryHandler(router.dispatch_callback))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, router.dispatch_text))
+    for command in ("start", "restart", "setreminder", "help", "myreminders", "deletereminder",
+                    "addchannel", "removechannel", "stats"):
+        application.add_handler(CommandHandler(command, noop))
+
+
+async def run(label, api, items, add_handlers, callback_data, chain):
+    application = Application.builder().token('123456:bench').base_url(api.base_url()).build()
+    conversations = ConversationStore()
+    if chain:
+        add_handlers(application)
+    else:
+        add_handlers(application, conversations)
+    await application.initialize()
+    updates = make_updates(application.bot, items, callback_data)
+
+    # Put each user in the conversation state the update expects
+    for update, state in updates:
+        if update.message is not None:
+            if chain:
+                application.user_data[update.effective_user.id]['waiting_for_text'] = state == 'reminder_text'
+            elif state is not None:
+                conversations.set(update.effective_user.id, state)
+
+    start = time.perf_counter()
+    for update, _ in updates:
+        await application.process_update(update)
+    elapsed = time.perf_counter() - start
+    await application.shutdown()
+    print(f"{label:<8} {len(updates)} updates: {elapsed / len(updates) * 1e6:6.1f} us/update")
+
+
+async def main(count):
+    api = await FakeBotAPI().start()
+    items = workload(count)
+    await run("chain", api, items, add_chain_handlers, OLD_CALLBACK_DATA, chain=True)
+    await run("router", api, items, add_router_handlers, NEW_CALLBACK_DATA, chain=False)
+    await api.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
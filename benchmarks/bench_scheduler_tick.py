@@ -0,0 +1,92 @@
+# Benchmark: scheduler tick latency, full-table scan vs. due-time heap.
+#
+# Usage: python benchmarks/bench_scheduler_tick.py [10000 100000 1000000]
+import datetime
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduler import DueHeap
+
+LOOKAHEAD = 1800
+TICKS = 20
+
+
+def build_db(rows):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''CREATE TABLE reminders
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, text TEXT, date TEXT)''')
+    now = datetime.datetime.now()
+    rng = random.Random(42)
+    conn.executemany(
+        "INSERT INTO reminders (chat_id, text, date) VALUES (?, ?, ?)",
+        ((rng.randrange(1, 50000), f"reminder {i}",
+          (now + datetime.timedelta(seconds=rng.randrange(60, 365 * 86400))).strftime("%Y-%m-%d %H:%M:%S"))
+         for i in range(rows)))
+    conn.commit()
+    return conn
+
+
+def parse_date(date_str):
+    try:
+        return datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M")
+
+
+# The original tick: read every row and parse every date
+def scan_tick(conn, now):
+    due = []
+    for reminder_id, chat_id, text, date_str in conn.execute("SELECT id, chat_id, text, date FROM reminders").fetchall():
+        time_difference = (parse_date(date_str) - now).total_seconds()
+        if 0 < time_difference <= LOOKAHEAD:
+            due.append((reminder_id, chat_id, text))
+    return due
+
+
+# The heap tick: pop what is due, then fetch those rows by primary key
+def heap_tick(conn, heap, now):
+    due = []
+    for reminder_id, due_at in heap.pop_due(now + LOOKAHEAD):
+        row = conn.execute("SELECT chat_id, text FROM reminders WHERE id = ?", (reminder_id,)).fetchone()
+        if row is not None:
+            due.append((reminder_id,) + row)
+    return due
+
+
+def run(rows):
+    conn = build_db(rows)
+
+    start = time.perf_counter()
+    heap = DueHeap()
+    heap.load((reminder_id, parse_date(date_str).timestamp())
+              for reminder_id, date_str in conn.execute("SELECT id, date FROM reminders"))
+    load_time = time.perf_counter() - start
+
+    scan_ticks = 1 if rows >= 1000000 else 3
+    now = datetime.datetime.now()
+    start = time.perf_counter()
+    for _ in range(scan_ticks):
+        scan_tick(conn, now)
+    scan_time = (time.perf_counter() - start) / scan_ticks
+
+    # Advance the clock two seconds per tick, as the job queue would
+    base = time.time()
+    fired = 0
+    start = time.perf_counter()
+    for tick in range(TICKS):
+        fired += len(heap_tick(conn, heap, base + tick * 2))
+    heap_time = (time.perf_counter() - start) / TICKS
+
+    print(f"{rows:>9} rows | scan tick {scan_time * 1000:10.2f} ms | heap tick {heap_time * 1000:8.3f} ms "
+          f"| heap load {load_time * 1000:9.1f} ms (once) | due over {TICKS} ticks: {fired}")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for size in sizes:
+        run(size)
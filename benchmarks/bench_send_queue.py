@@ -0,0 +1,98 @@
+# Benchmark: outbound send queue against a rate-limited fake bot.
+#
+# Simulates a burst of reminders that all fall due at once, plus a backlog of
+# follow-ups, with Telegram's limits scaled up by SPEEDUP so it runs quickly.
+# Usage: python benchmarks/bench_send_queue.py [reminders] [chats]
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fakebot import FakeBot
+from sender import SendQueue, PRIORITY_REMINDER, PRIORITY_FOLLOW_UP
+
+SPEEDUP = 10
+GLOBAL_RATE = 30 * SPEEDUP
+CHAT_RATE = 1 * SPEEDUP
+NOISY_CHAT_SHARE = 0.02
+
+
+def workload(reminders, chats):
+    rng = random.Random(7)
+    messages = []
+    for i in range(reminders):
+        # One noisy chat owns a slice of the burst; the rest is spread over all chats
+        chat_id = 0 if rng.random() < NOISY_CHAT_SHARE else rng.randrange(1, chats)
+        priority = PRIORITY_FOLLOW_UP if i % 2 else PRIORITY_REMINDER
+        messages.append((chat_id, priority, f"reminder {i}"))
+    return messages
+
+
+# Every job callback calls send_message itself, as the bot used to
+async def run_direct(messages):
+    bot = FakeBot(global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, retry_after=1 / SPEEDUP)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bot.send_message(chat_id=chat_id, text=text)
+                                     for chat_id, priority, text in messages), return_exceptions=True)
+    dropped = sum(isinstance(result, Exception) for result in results)
+    elapsed = time.perf_counter() - start
+    print(f"direct sends : {len(bot.sent):6} delivered, {dropped:6} rejected with 429 "
+          f"in {elapsed:.2f}s")
+
+
+async def run_queued(messages):
+    bot = FakeBot(global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, retry_after=1 / SPEEDUP)
+    send_queue = SendQueue(bot, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE)
+    send_queue.start()
+
+    latencies = {PRIORITY_REMINDER: [], PRIORITY_FOLLOW_UP: []}
+    per_chat = {}
+    start = time.perf_counter()
+
+    def record(priority, chat_id):
+        def done(future):
+            latency = time.perf_counter() - start
+            latencies[priority].append(latency)
+            per_chat.setdefault(chat_id, []).append(latency)
+        return done
+
+    for chat_id, priority, text in messages:
+        send_queue.send(chat_id, priority=priority, text=text).add_done_callback(record(priority, chat_id))
+    depth_at_burst = send_queue.depth()
+    await send_queue.stop()
+    elapsed = time.perf_counter() - start
+
+    stats = send_queue.stats()
+    busiest = Counter(chat_id for chat_id, _, _ in messages).most_common(1)[0]
+    lower_bound = max(len(messages) / GLOBAL_RATE, busiest[1] / CHAT_RATE)
+    print(f"send queue   : {stats['sent']:6} delivered, {bot.rejected:6} rejected with 429 "
+          f"in {elapsed:.2f}s ({stats['sent'] / elapsed:.0f} msg/s, limit {GLOBAL_RATE}/s, "
+          f"best possible {lower_bound:.2f}s)")
+    print(f"  backlog after burst: {depth_at_burst}, max depth {stats['max_depth']}")
+    for priority, name in ((PRIORITY_REMINDER, 'first-fire'), (PRIORITY_FOLLOW_UP, 'follow-up ')):
+        values = sorted(latencies[priority])
+        if values:
+            print(f"  {name} latency: p50 {statistics.median(values):.2f}s  "
+                  f"p99 {values[int(len(values) * 0.99) - 1]:.2f}s")
+
+    # Fairness: a chat's first message should not wait on other chats' backlogs
+    first_latency = [min(values) for values in per_chat.values()]
+    print(f"  first message per chat: p50 {statistics.median(first_latency):.2f}s, "
+          f"max {max(first_latency):.2f}s (busiest chat has {busiest[1]} messages)")
+
+    # The fake bot's own limits were never exceeded
+    peak = Counter(int(t * SPEEDUP) for t, _, _ in bot.sent).most_common(1)[0][1]
+    print(f"  peak per-{1 / SPEEDUP:.1f}s window: {peak} sends")
+
+
+if __name__ == '__main__':
+    reminders = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    messages = workload(reminders, chats)
+    asyncio.run(run_direct(messages))
+    asyncio.run(run_queued(messages))
@@ -0,0 +1,55 @@
+# Benchmark: reminder write throughput, commit-per-write vs. group commit.
+#
+# Usage: python benchmarks/bench_write_batching.py [threads] [writes_per_thread]
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage
+
+
+def hammer(threads, writes, write):
+    def worker(thread_index):
+        for i in range(writes):
+            write(thread_index, i)
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return threads * writes / (time.perf_counter() - start)
+
+
+def run(threads, writes, batch_writes, synchronous):
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.PRAGMAS = [pragma for pragma in storage.PRAGMAS if 'synchronous' not in pragma]
+        storage.PRAGMAS.append(f"PRAGMA synchronous={synchronous}")
+        storage.init_storage(os.path.join(tmp, 'reminders.db'), os.path.join(tmp, 'channels.db'),
+                             batch_writes=batch_writes)
+
+        # Every handler waits for its own write to be committed (durable mode)
+        def write(thread_index, i):
+            storage.add_reminder(thread_index, f"reminder {i}", int(time.time()) + i).result()
+
+        rate = hammer(threads, writes, write)
+        writer = storage._reminders_writer
+        batches = writer.batches if writer else threads * writes
+        storage.close_storage()
+        return rate, threads * writes / batches
+
+
+if __name__ == '__main__':
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    writes = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    for synchronous in ('NORMAL', 'FULL'):
+        for batch_writes in (False, True):
+            rate, per_commit = run(threads, writes, batch_writes, synchronous)
+            mode = 'group commit  ' if batch_writes else 'commit-per-op '
+            print(f"synchronous={synchronous:<6} {mode} {threads} threads: {rate:9.0f} writes/s "
+                  f"({per_commit:5.1f} writes per commit)")
@@ -0,0 +1,253 @@
+# Local stand-in for the Telegram Bot API, used by the load tests.
+#
+# A small HTTP/1.1 server that answers the Bot API methods the bot calls
+# (getMe, getUpdates, sendMessage, editMessageText, ...). Tests push updates
+# with push_update() and wait for the bot's answers with wait_for_call().
+# Point the bot at it with base_url=f"http://127.0.0.1:{port}/bot".
+#
+# Like Telegram, once the bot calls setWebhook, updates are POSTed to that URL
+# instead of being returned by getUpdates, over at most max_connections
+# connections; updates answered with an error are retried a second later.
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlsplit
+
+# Telegram's default for setWebhook's max_connections
+WEBHOOK_CONNECTIONS = 40
+WEBHOOK_RETRY_DELAY = 1
+
+# The bot opens up to a few hundred connections at once; a short accept queue
+# would drop SYNs and add seconds of retransmit delay to the measurements
+BACKLOG = 4096
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot',
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False}
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+
+
+def chat(chat_id):
+    return {'id': chat_id, 'type': 'private'}
+
+
+class FakeBotAPI:
+    def __init__(self, member_status='member'):
+        self.member_status = member_status
+        self.port = None
+        self.calls = 0
+        self.methods = defaultdict(int)
+        self._server = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self._updates = []
+        self._updates_ready = asyncio.Event()
+        # Calls addressed to each chat, and how far each waiter has read them
+        self._chat_calls = defaultdict(list)
+        self._chat_cursor = defaultdict(int)
+        self._chat_events = defaultdict(asyncio.Event)
+        # Every update pushed, in order, so a run can be saved and replayed
+        self.pushed = []
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_retries = 0
+        self._webhook_slots = None
+        self._webhook_connections = []
+        self._deliveries = set()
+        # writer -> task handling the connection
+        self._connections = {}
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._handle_connection, host, port, backlog=BACKLOG)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        for task in self._deliveries:
+            task.cancel()
+        for _, writer in self._webhook_connections:
+            writer.close()
+        self._server.close()
+        # Release any getUpdates long poll still waiting
+        self._updates_ready.set()
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    # Updates
+
+    def push_update(self, update):
+        update['update_id'] = next(self._update_ids)
+        self.pushed.append(update)
+        if self.webhook_url is not None:
+            task = asyncio.get_running_loop().create_task(self._deliver(update))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+            return
+        self._updates.append(update)
+        self._updates_ready.set()
+
+    def push_message(self, user_id, text):
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': chat(user_id), 'from': user(user_id), 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self.push_update({'message': message})
+
+    def push_callback(self, user_id, data):
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': chat(user_id), 'from': BOT_USER, 'text': 'menu'}
+        self.push_update({'callback_query': {'id': str(next(self._callback_ids)), 'from': user(user_id),
+                                             'chat_instance': str(user_id), 'data': data, 'message': message}})
+
+    # Wait for the next call to a chat that matches predicate(method, params);
+    # returns (method, params, time.time() when the call arrived)
+    async def wait_for_call(self, chat_id, predicate, timeout=30):
+        deadline = time.monotonic() + timeout
+        calls = self._chat_calls[chat_id]
+        event = self._chat_events[chat_id]
+        while True:
+            while self._chat_cursor[chat_id] < len(calls):
+                method, params, received_at = calls[self._chat_cursor[chat_id]]
+                self._chat_cursor[chat_id] += 1
+                if predicate(method, params):
+                    return method, params, received_at
+            event.clear()
+            await asyncio.wait_for(event.wait(), max(0, deadline - time.monotonic()))
+
+    # Every call made to a chat so far, as (method, params, time.time() when it arrived)
+    def calls_to(self, chat_id):
+        return list(self._chat_calls[chat_id])
+
+    # Webhook delivery
+
+    def set_webhook(self, url, secret_token=None, max_connections=WEBHOOK_CONNECTIONS):
+        self.webhook_url = urlsplit(url)
+        self.webhook_secret = secret_token
+        self._webhook_slots = asyncio.Semaphore(max_connections)
+
+    async def _deliver(self, update):
+        body = json.dumps(update).encode()
+        async with self._webhook_slots:
+            while await self._post(body) != 200:
+                self.webhook_retries += 1
+                await asyncio.sleep(WEBHOOK_RETRY_DELAY)
+
+    # Function to POST one update on an idle keep-alive connection; returns the status code
+    async def _post(self, body):
+        url = self.webhook_url
+        if self._webhook_connections:
+            reader, writer = self._webhook_connections.pop()
+        else:
+            reader, writer = await asyncio.open_connection(url.hostname, url.port)
+        secret = b'X-Telegram-Bot-Api-Secret-Token: %s\r\n' % self.webhook_secret.encode() if self.webhook_secret else b''
+        writer.write(b'POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n%s'
+                     b'Content-Length: %d\r\n\r\n%s' % (url.path.encode(), url.netloc.encode(), secret, len(body), body))
+        try:
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+        except (IndexError, ValueError, ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return None
+        self._webhook_connections.append((reader, writer))
+        return status
+
+    # HTTP
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method = path.rsplit('/', 1)[-1]
+                result = await self._call(method, self._parse_params(headers, body))
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (len(payload), payload))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    # Parameters arrive form-encoded, with non-string values JSON-encoded
+    @staticmethod
+    def _parse_params(headers, body):
+        if headers.get('content-type', '').startswith('application/json'):
+            return json.loads(body or b'{}')
+        params = {}
+        for name, value in parse_qsl(body.decode()):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                params[name] = value
+        return params
+
+    async def _call(self, method, params):
+        self.calls += 1
+        self.methods[method] += 1
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'setWebhook':
+            self.set_webhook(params['url'], params.get('secret_token'),
+                             int(params.get('max_connections') or WEBHOOK_CONNECTIONS))
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'answerCallbackQuery':
+            return True
+        if method == 'getChatMember':
+            return {'status': self.member_status, 'user': user(int(params['user_id']))}
+
+        chat_id = int(params['chat_id']) if 'chat_id' in params else None
+        if chat_id is not None:
+            self._chat_calls[chat_id].append((method, params, time.time()))
+            self._chat_events[chat_id].set()
+        if method in ('sendMessage', 'editMessageText'):
+            return {'message_id': params.get('message_id') or next(self._message_ids), 'date': int(time.time()),
+                    'chat': chat(chat_id), 'from': BOT_USER, 'text': params.get('text', '')}
+        return True
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        # Updates below the offset have been confirmed by the bot
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
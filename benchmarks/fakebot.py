@@ -0,0 +1,59 @@
+# Offline stand-in for telegram.Bot, used by the benchmarks.
+#
+# It records every send and enforces Telegram-like rate limits, raising
+# FakeRetryAfter (like telegram.error.RetryAfter) when a limit is exceeded.
+import asyncio
+import itertools
+import time
+import types
+from collections import defaultdict, deque
+
+
+class FakeRetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class FakeBot:
+    def __init__(self, global_rate=30, chat_rate=1, latency=0.0, retry_after=1,
+                 clock=time.monotonic):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.latency = latency
+        self.retry_after = retry_after
+        self.clock = clock
+        self.sent = []
+        self.rejected = 0
+        self.member_statuses = {}
+        self._message_ids = itertools.count(1)
+        self._global_window = deque()
+        self._chat_windows = defaultdict(deque)
+
+    # Sliding one-second windows, like Telegram's flood control
+    def _check_limits(self, chat_id, now):
+        window = self._global_window
+        while window and window[0] <= now - 1:
+            window.popleft()
+        chat_window = self._chat_windows[chat_id]
+        while chat_window and chat_window[0] <= now - 1:
+            chat_window.popleft()
+        if len(window) >= self.global_rate or len(chat_window) >= self.chat_rate:
+            self.rejected += 1
+            raise FakeRetryAfter(self.retry_after)
+        window.append(now)
+        chat_window.append(now)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        now = self.clock()
+        self._check_limits(chat_id, now)
+        message_id = next(self._message_ids)
+        self.sent.append((now, chat_id, text))
+        return types.SimpleNamespace(message_id=message_id, chat_id=chat_id, text=text)
+
+    async def get_chat_member(self, chat_id, user_id):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return types.SimpleNamespace(status=self.member_statuses.get((chat_id, user_id), 'member'))
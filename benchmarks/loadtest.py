@@ -0,0 +1,287 @@
+# Load test: simulated users and scheduled reminders against the real bot and
+# a local fake Bot API. Runs headless; nothing talks to Telegram.
+#
+# Every user goes through the whole flow concurrently: /start, Set Reminder,
+# reminder text, two dates, My Reminders, Done on the first reminder, then
+# /deletereminder and Delete on the second. Step latency is measured from
+# pushing the update to the bot's answer.
+#
+# At the same time --fires reminders, each in its own chat, fall due spread
+# over --fire-window seconds. They are written to the database before the bot
+# starts, and each one is timed from its due time to the sendMessage that
+# delivers it. Reminders that do not arrive within --fire-timeout are missed;
+# those later than --late-after seconds are late.
+#
+# --webhook has the fake Bot API post updates to the bot's webhook server
+# instead of the bot polling for them. --record-updates saves every update
+# pushed, one JSON object per line, for benchmarks/replay_updates.py.
+#
+# --output saves the results as JSON; --baseline compares against a saved run
+# and exits with status 1 if anything got worse by more than --tolerance.
+# Usage: python benchmarks/loadtest.py [--users N] [--fires N] [--webhook] [--output run.json] [--baseline base.json]
+import argparse
+import asyncio
+import datetime
+import importlib.util
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+from router import encode_callback
+
+TOKEN = '123456:loadtest'
+CHANNEL_ID = -1001
+FIRST_USER_ID = 1000
+# Chats of the scheduled reminders, well clear of the users
+FIRST_FIRE_CHAT_ID = 10 ** 7
+STEPS = ('start', 'set reminder', 'reminder text', 'reminder date', 'second date', 'my reminders', 'done',
+         'delete list', 'delete')
+
+
+def load_bot():
+    spec = importlib.util.spec_from_file_location('reminder_bot', os.path.join(ROOT, 'reminder&M.py'))
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    return bot
+
+
+def text_contains(fragment):
+    return lambda method, params: fragment in params.get('text', '')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(0, int(len(values) * fraction + 0.5) - 1)] if values else None
+
+
+async def run_user(bot, api, user_id, latencies):
+    async def step(name, push, predicate):
+        start = time.perf_counter()
+        push()
+        result = await api.wait_for_call(user_id, predicate)
+        latencies[name].append(time.perf_counter() - start)
+        return result
+
+    text = f"load test reminder {user_id}"
+    tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+    first_due = tomorrow.strftime("%Y-%m-%d %H:%M")
+    second_due = (tomorrow + datetime.timedelta(hours=1)).strftime("%Y-%m-%d %H:%M")
+
+    await step('start', lambda: api.push_message(user_id, '/start'), text_contains('Welcome!'))
+    await step('set reminder', lambda: api.push_callback(user_id, encode_callback(bot.CB_SET_REMINDER)),
+               text_contains('enter the text'))
+    await step('reminder text', lambda: api.push_message(user_id, text), text_contains('date and time'))
+    await step('reminder date', lambda: api.push_message(user_id, first_due), text_contains('set successfully'))
+    await step('second date', lambda: api.push_message(user_id, second_due), text_contains('set successfully'))
+    _, params, _ = await step('my reminders', lambda: api.push_callback(user_id, encode_callback(bot.CB_MY_REMINDERS)),
+                              text_contains('Your reminders'))
+    first_id, second_id = re.findall(rf"(\d+)\. {text} - ", params['text'])
+    await step('done', lambda: api.push_callback(user_id, encode_callback(bot.CB_DONE, first_id)),
+               text_contains('marked as done'))
+    await step('delete list', lambda: api.push_message(user_id, '/deletereminder'),
+               text_contains('Select a reminder to delete'))
+    await step('delete', lambda: api.push_callback(user_id, encode_callback(bot.CB_DELETE, second_id)),
+               text_contains('deleted successfully'))
+
+
+# Function to write the scheduled reminders straight into the bot's database; returns [(chat_id, due_at)]
+def seed_fires(fires, lead, window):
+    import bulk
+    import storage
+    from migrations import ensure_reminders_schema
+
+    start = int(time.time()) + lead
+    reminders = [(FIRST_FIRE_CHAT_ID + i, f"fire {i}", start + i * window // max(fires, 1), None, 0, 0, None)
+                 for i in range(fires)]
+    conn = storage.connect(storage.REMINDERS_DB_PATH)
+    ensure_reminders_schema(conn)
+    bulk.import_rows(conn, reminders)
+    conn.close()
+    return [(chat_id, due_at) for chat_id, _, due_at, *_ in reminders]
+
+
+async def watch_fire(api, chat_id, due_at, timeout, lateness):
+    try:
+        _, _, received_at = await api.wait_for_call(chat_id, text_contains('Reminder ('),
+                                                    timeout=max(0, due_at - time.time()) + timeout)
+    except asyncio.TimeoutError:
+        return
+    lateness.append(received_at - due_at)
+
+
+async def run(args):
+    bot = load_bot()
+    # Any free port, so a running bot or another load test does not get in the way
+    bot.METRICS_PORT = 0
+    api = await FakeBotAPI().start()
+
+    # The bot keeps its databases and channel list in the working directory
+    workdir = tempfile.mkdtemp(prefix='reminder-loadtest-')
+    os.chdir(workdir)
+    with open('channel_info.json', 'w') as file:
+        json.dump({'channel_chat_ids': [CHANNEL_ID]}, file)
+    fires = seed_fires(args.fires, args.fire_lead, args.fire_window)
+
+    application = bot.build_application(TOKEN, base_url=api.base_url())
+    await application.initialize()
+    await application.post_init(application)
+    if args.webhook:
+        bot.WEBHOOK_PORT = 0
+        await application.start()
+        await bot.start_webhook(application)
+        api.set_webhook(f"http://127.0.0.1:{bot.webhook_server.port}{bot.webhook.WEBHOOK_PATH}")
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+        await application.start()
+
+    latencies = defaultdict(list)
+    lateness = []
+    start = time.perf_counter()
+    fire_watchers = asyncio.gather(*(watch_fire(api, chat_id, due_at, args.fire_timeout, lateness)
+                                     for chat_id, due_at in fires))
+    results = await asyncio.gather(*(run_user(bot, api, user_id, latencies)
+                                     for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await fire_watchers
+    failed = [result for result in results if isinstance(result, BaseException)]
+
+    if args.webhook:
+        await bot.webhook_server.stop()
+    else:
+        await application.updater.stop()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+    if args.record_updates:
+        with open(args.record_updates, 'w') as file:
+            file.writelines(json.dumps(update) + '\n' for update in api.pushed)
+
+    updates = sum(len(values) for values in latencies.values())
+    return {
+        'users': args.users,
+        'mode': 'webhook' if args.webhook else 'polling',
+        'failed_users': len(failed),
+        'first_failure': repr(failed[0]) if failed else None,
+        'updates': updates,
+        'elapsed': elapsed,
+        'throughput': updates / elapsed if elapsed else 0.0,
+        'api_calls': api.calls,
+        'webhook_retries': api.webhook_retries,
+        'steps': {name: {'p50': statistics.median(latencies[name]), 'p99': percentile(latencies[name], 0.99)}
+                  for name in STEPS if latencies[name]},
+        'fires': {
+            'scheduled': len(fires),
+            'delivered': len(lateness),
+            'missed': len(fires) - len(lateness),
+            'late': sum(1 for value in lateness if value > args.late_after),
+            'late_after': args.late_after,
+            'p50': statistics.median(lateness) if lateness else None,
+            'p99': percentile(lateness, 0.99),
+            'max': max(lateness) if lateness else None,
+        },
+        'workdir': workdir,
+    }
+
+
+def ms(value):
+    return f"{value * 1000:8.1f} ms" if value is not None else "       -   "
+
+
+def report(result):
+    print(f"{result['users']} users ({result['mode']}), {result['updates']} updates in {result['elapsed']:.2f}s "
+          f"({result['throughput']:.0f} updates/s), {result['failed_users']} users failed, "
+          f"{result['api_calls']} Bot API calls")
+    if result['webhook_retries']:
+        print(f"  {result['webhook_retries']} webhook deliveries shed and retried")
+    for name, step in result['steps'].items():
+        print(f"  {name:<14} p50 {ms(step['p50'])}  p99 {ms(step['p99'])}")
+    fires = result['fires']
+    if fires['scheduled']:
+        print(f"{fires['scheduled']} reminders fired: {fires['delivered']} delivered, {fires['missed']} missed, "
+              f"{fires['late']} later than {fires['late_after']}s")
+        print(f"  lateness       p50 {ms(fires['p50'])}  p99 {ms(fires['p99'])}  max {ms(fires['max'])}")
+    if result['first_failure']:
+        print(f"  first failure: {result['first_failure']}")
+    print(f"  data in {result['workdir']}")
+
+
+# Function to print how a run compares with a baseline; returns the regressions found
+def compare(result, baseline, tolerance):
+    rows = [('throughput', baseline['throughput'], result['throughput'], True)]
+    for name, step in result['steps'].items():
+        if name in baseline['steps']:
+            for key in ('p50', 'p99'):
+                rows.append((f"{name} {key}", baseline['steps'][name][key], step[key], False))
+    for key in ('p50', 'p99'):
+        rows.append((f"fire lateness {key}", baseline['fires'][key], result['fires'][key], False))
+
+    regressions = []
+    print(f"Compared with baseline (tolerance {tolerance:.0%}):")
+    for label, before, after, higher_is_better in rows:
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(label)
+        print(f"  {label:<22} {before:10.4f} -> {after:10.4f}  {change:+7.1%}{flag}")
+    for key in ('failed_users',):
+        if result[key] > baseline[key]:
+            regressions.append(key)
+            print(f"  {key:<22} {baseline[key]} -> {result[key]}  REGRESSION")
+    for key in ('missed', 'late'):
+        if result['fires'][key] > baseline['fires'][key]:
+            regressions.append(f"{key} reminders")
+            print(f"  {key + ' reminders':<22} {baseline['fires'][key]} -> {result['fires'][key]}  REGRESSION")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against a fake Bot API.")
+    parser.add_argument('users', nargs='?', type=int, help="same as --users")
+    parser.add_argument('--users', dest='users_option', type=int, default=1000, help="simulated users")
+    parser.add_argument('--fires', type=int, default=0, help="reminders that fall due during the run")
+    parser.add_argument('--fire-window', type=int, default=30, help="seconds the due times are spread over")
+    parser.add_argument('--fire-lead', type=int, default=5, help="seconds from start to the first due time")
+    parser.add_argument('--fire-timeout', type=float, default=60, help="seconds after its due time a reminder is missed")
+    parser.add_argument('--late-after', type=float, default=2, help="seconds after its due time a reminder is late")
+    parser.add_argument('--webhook', action='store_true', help="deliver updates to the bot's webhook server")
+    parser.add_argument('--record-updates', help="save the updates pushed to this JSONL file")
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--baseline', help="compare with the results saved by an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative regression, default 0.2")
+    args = parser.parse_args()
+    args.users = args.users if args.users is not None else args.users_option
+    # The run changes into a temporary directory
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+    args.record_updates = os.path.abspath(args.record_updates) if args.record_updates else None
+
+    result = asyncio.run(run(args))
+    report(result)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
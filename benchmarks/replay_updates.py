@@ -0,0 +1,179 @@
+# Replay recorded updates against the bot's webhook.
+#
+# Reads updates from a JSONL file (e.g. saved by loadtest.py --record-updates)
+# and POSTs them to the webhook the way Telegram does: the updates of one chat
+# one after another, different chats over up to --connections connections at
+# once. Updates answered with 503 are counted as shed and sent again a second
+# later.
+#
+# By default the bot is started for the run with --webhook, pointed at a local
+# fake Bot API, in a temporary directory. With --url the updates go to a bot
+# that is already running and nothing else is started.
+#
+# Reports how fast updates were accepted, how many were shed, and, for the
+# local bot, how many answers it sent and how many texts arrived outside the
+# flow they belong to, which would mean a chat's updates ran out of order.
+# Usage: python benchmarks/replay_updates.py FILE [--connections N] [--url URL] [--secret S]
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+from loadtest import CHANNEL_ID, TOKEN, ms, percentile
+
+RETRY_DELAY = 1
+# Seconds the local bot gets to answer after the last update was accepted
+DRAIN_TIMEOUT = 30
+
+
+def update_chat(update):
+    if 'callback_query' in update:
+        return update['callback_query']['from']['id']
+    for kind in ('message', 'edited_message'):
+        if kind in update:
+            return update[kind]['chat']['id']
+    return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Function to POST one update on a keep-alive connection; returns the status code
+async def post(connection, url, body, secret):
+    reader, writer = connection
+    headers = f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n" if secret else ""
+    writer.write(f"POST {url.path} HTTP/1.1\r\nHost: {url.netloc}\r\nContent-Type: application/json\r\n"
+                 f"{headers}Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def replay(updates, url, connections, secret):
+    lanes = defaultdict(list)
+    for update in updates:
+        lanes[update_chat(update)].append(update)
+    ready = asyncio.Queue()
+    for lane in lanes.values():
+        ready.put_nowait(lane)
+    statuses = defaultdict(int)
+    latencies = []
+
+    async def connection_worker():
+        connection = await asyncio.open_connection(url.hostname, url.port)
+        while not ready.empty():
+            for update in ready.get_nowait():
+                body = json.dumps(update).encode()
+                while True:
+                    start = time.perf_counter()
+                    status = await post(connection, url, body, secret)
+                    latencies.append(time.perf_counter() - start)
+                    statuses[status] += 1
+                    if status != 503:
+                        break
+                    await asyncio.sleep(RETRY_DELAY)
+        connection[1].close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connection_worker() for _ in range(min(connections, len(lanes)))))
+    return time.perf_counter() - start, statuses, latencies
+
+
+async def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"bot exited with status {process.returncode}")
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("bot did not open its webhook port")
+
+
+async def run(args):
+    with open(args.file) as file:
+        updates = [json.loads(line) for line in file if line.strip()]
+    result = {'updates': len(updates), 'answers': None}
+    if args.url:
+        result['elapsed'], result['statuses'], result['latencies'] = await replay(
+            updates, urlsplit(args.url), args.connections, args.secret)
+        return result
+
+    api = await FakeBotAPI().start()
+    workdir = tempfile.mkdtemp(prefix='reminder-replay-')
+    with open(os.path.join(workdir, 'channel_info.json'), 'w') as file:
+        json.dump({'channel_chat_ids': [CHANNEL_ID]}, file)
+    port = free_port()
+    log = open(os.path.join(workdir, 'bot.log'), 'w')
+    env = dict(os.environ, WEBHOOK_SECRET=args.secret) if args.secret else None
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'reminder&M.py'), '--webhook', '--token', TOKEN,
+                                '--base-url', api.base_url(), '--webhook-port', str(port), '--metrics-port', '0'],
+                               cwd=workdir, stdout=log, stderr=subprocess.STDOUT, env=env)
+    try:
+        await wait_for_port(port, process)
+        result['elapsed'], result['statuses'], result['latencies'] = await replay(
+            updates, urlsplit(f"http://127.0.0.1:{port}/webhook"), args.connections, args.secret)
+        # Every update gets at least one answer; wait until they stop coming
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        calls = -1
+        while calls != api.calls and time.monotonic() < deadline:
+            calls = api.calls
+            await asyncio.sleep(1)
+    finally:
+        process.terminate()
+        process.wait()
+        await api.stop()
+
+    answers = [call for chat_id in {update_chat(update) for update in updates} for call in api.calls_to(chat_id)]
+    result['answers'] = len(answers)
+    result['out_of_flow'] = sum(1 for _, params, _ in answers if params.get('text') == 'Use /start to set a reminder.')
+    result['workdir'] = workdir
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST recorded updates to the bot's webhook.")
+    parser.add_argument('file', help="JSONL file with one update per line")
+    parser.add_argument('--connections', type=int, default=40, help="connections at once, like max_connections")
+    parser.add_argument('--url', help="webhook of a running bot; by default a local bot is started")
+    parser.add_argument('--secret', help="secret token the webhook expects")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    statuses = result['statuses']
+    others = {status: count for status, count in statuses.items() if status not in (200, 503)}
+    print(f"{result['updates']} updates replayed in {result['elapsed']:.2f}s "
+          f"({statuses.get(200, 0) / result['elapsed']:.0f} accepted/s), {statuses.get(503, 0)} shed and retried, "
+          f"other statuses: {others or 'none'}")
+    print(f"  POST           p50 {ms(percentile(result['latencies'], 0.5))}  "
+          f"p99 {ms(percentile(result['latencies'], 0.99))}")
+    if result['answers'] is not None:
+        print(f"  {result['answers']} answers from the bot, {result['out_of_flow']} texts handled outside their flow")
+        print(f"  data and bot log in {result['workdir']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Sharded deployment test: several worker processes on one machine against a
+# local fake Bot API, with one worker killed halfway through.
+#
+# --fires reminders, each in its own chat, are written to a fresh database and
+# fall due spread over --fire-window seconds. --workers bot processes are started
+# with --role worker; they split the shards between them by lease. After
+# --kill-after seconds worker 0 is killed with SIGKILL, so it cannot hand its
+# shards back, and the others must take them over once its leases expire.
+#
+# Every reminder should be delivered exactly once. Reports deliveries, misses,
+# duplicates and lateness, split into the killed worker's shards and the rest;
+# exits with status 1 if a reminder was missed. Keep --fires / --fire-window
+# below sender.GLOBAL_RATE, which the workers share, or sends queue up.
+# Usage: python benchmarks/shardtest.py [--workers N] [--fires N] [--kill-after S]
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+from loadtest import CHANNEL_ID, TOKEN, ms, percentile, seed_fires
+from sharding import SHARD_COUNT, shard_of
+
+
+def start_worker(index, workers, base_url, workdir):
+    log = open(os.path.join(workdir, f'worker-{index}.log'), 'w')
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, 'reminder&M.py'), '--role', 'worker',
+                             '--worker', str(index), '--workers', str(workers), '--token', TOKEN,
+                             '--base-url', base_url, '--metrics-port', '0'],
+                            cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+
+
+# Function to summarise the deliveries of a group of reminders
+def summarise(api, fires):
+    lateness, missed, duplicates = [], 0, 0
+    for chat_id, due_at in fires:
+        sent = [received_at for method, params, received_at in api.calls_to(chat_id)
+                if 'Reminder (' in params.get('text', '')]
+        if not sent:
+            missed += 1
+            continue
+        duplicates += len(sent) - 1
+        lateness.append(sent[0] - due_at)
+    return {
+        'scheduled': len(fires),
+        'delivered': len(lateness),
+        'missed': missed,
+        'duplicates': duplicates,
+        'p50': statistics.median(lateness) if lateness else None,
+        'p99': percentile(lateness, 0.99),
+        'max': max(lateness) if lateness else None,
+    }
+
+
+async def run(args):
+    api = await FakeBotAPI().start()
+
+    # The workers keep their databases and channel list in the working directory
+    workdir = tempfile.mkdtemp(prefix='reminder-shardtest-')
+    os.chdir(workdir)
+    with open('channel_info.json', 'w') as file:
+        json.dump({'channel_chat_ids': [CHANNEL_ID]}, file)
+    fires = seed_fires(args.fires, args.fire_lead, args.fire_window)
+    last_due = max((due_at for _, due_at in fires), default=time.time())
+
+    processes = [start_worker(i, args.workers, api.base_url(), workdir) for i in range(args.workers)]
+    try:
+        await asyncio.sleep(args.kill_after)
+        processes[0].send_signal(signal.SIGKILL)
+        killed_at = time.time()
+        await asyncio.sleep(max(0, last_due - time.time()) + args.fire_timeout)
+    finally:
+        for process in processes[1:]:
+            process.send_signal(signal.SIGTERM)
+        for process in processes:
+            process.wait()
+    await api.stop()
+
+    # Shards the killed worker held before it died: its preferred ones
+    killed_shards = {shard for shard in range(SHARD_COUNT) if shard % args.workers == 0}
+    orphaned = [(chat_id, due_at) for chat_id, due_at in fires
+                if shard_of(chat_id) in killed_shards and due_at >= killed_at]
+    others = [fire for fire in fires if fire not in set(orphaned)]
+    return {
+        'workers': args.workers,
+        'killed_at': killed_at,
+        'taken_over': summarise(api, orphaned),
+        'others': summarise(api, others),
+        'workdir': workdir,
+    }
+
+
+def report(result):
+    print(f"{result['workers']} workers, worker 0 killed")
+    for label in ('taken_over', 'others'):
+        fires = result[label]
+        print(f"  {label.replace('_', ' '):<11} {fires['scheduled']:>6} scheduled, {fires['delivered']} delivered, "
+              f"{fires['missed']} missed, {fires['duplicates']} duplicates")
+        print(f"  {'':<11} lateness p50 {ms(fires['p50'])}  p99 {ms(fires['p99'])}  max {ms(fires['max'])}")
+    print(f"  data and worker logs in {result['workdir']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kill a worker of a sharded deployment and check takeover.")
+    parser.add_argument('--workers', type=int, default=3, help="worker processes")
+    parser.add_argument('--fires', type=int, default=1000, help="reminders that fall due during the run")
+    parser.add_argument('--fire-window', type=int, default=60, help="seconds the due times are spread over")
+    parser.add_argument('--fire-lead', type=int, default=10, help="seconds from start to the first due time")
+    parser.add_argument('--fire-timeout', type=float, default=40, help="seconds after the last due time to wait")
+    parser.add_argument('--kill-after', type=float, default=25, help="seconds before worker 0 is killed")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    report(result)
+    if result['taken_over']['missed'] or result['others']['missed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
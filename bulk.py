@@ -0,0 +1,198 @@
+import argparse
+import csv
+import datetime
+import json
+import logging
+import os
+from itertools import islice
+import storage
+from migrations import REMINDERS_INDEXES_SQL, ensure_reminders_schema
+from recurrence import parse_repeat
+
+logger = logging.getLogger(__name__)
+
+# Rows per executemany transaction on import, and per fetchmany on export
+IMPORT_CHUNK_SIZE = 20000
+EXPORT_CHUNK_SIZE = 20000
+# Bad rows that are logged individually; the rest are only counted
+MAX_LOGGED_ERRORS = 20
+# Page cache for the import/export connection (negative = KiB); a bigger cache
+# keeps more index pages in memory while rows are inserted
+BULK_CACHE_SIZE = -131072
+# Secondary indexes on reminders. An offline import drops them and builds them
+# again at the end, which is several times faster than updating them per row.
+REMINDERS_INDEXES = ('idx_reminders_chat_page', 'idx_reminders_pending')
+
+# repeat is optional on import
+IMPORT_FIELDS = ('chat_id', 'text', 'due_at', 'repeat')
+EXPORT_FIELDS = ('id', 'chat_id', 'text', 'due_at', 'repeat', 'fired', 'acknowledged')
+SQL_EXPORT_REMINDERS = f"SELECT {', '.join(EXPORT_FIELDS)} FROM reminders ORDER BY id"
+# Imported rows keep the fired/acknowledged state an export wrote for them. A row
+# whose id, chat and text match a reminder that is already there is skipped, so
+# importing an export into the database it came from adds nothing twice. New rows
+# always get a new id, above every existing one, so the bot picks them up.
+SQL_IMPORT_REMINDER = ("INSERT INTO reminders (chat_id, text, due_at, repeat, fired, acknowledged) "
+                       "SELECT ?1, ?2, ?3, ?4, ?5, ?6 "
+                       "WHERE NOT EXISTS (SELECT 1 FROM reminders WHERE id = ?7 AND chat_id = ?1 AND text = ?2)")
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+# Function to pick csv or jsonl from a file name
+def detect_format(path):
+    fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f"Unknown file type for {path}, expected one of {', '.join(FORMATS)}")
+    return fmt
+
+
+# Function to read a due time: epoch seconds, or an ISO date/time in local time
+def parse_due_at(value):
+    # JSON true/false are ints to Python, but not times
+    if isinstance(value, bool):
+        raise ValueError(f"bad due_at {value!r}")
+    if isinstance(value, int):
+        return value
+    value = str(value).strip()
+    if value.lstrip('-').isdigit():
+        return int(value)
+    return int(datetime.datetime.fromisoformat(value).timestamp())
+
+
+# Function to read an optional integer column: id, fired or acknowledged
+def parse_optional_int(value, default=None):
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+# Streams (chat_id, text, due_at, repeat, fired, acknowledged, id) tuples out of a CSV
+# or JSONL file, one line at a time. The last three are only in exported files.
+# Rows that cannot be parsed are skipped and counted in `skipped`.
+class ReminderReader:
+    def __init__(self, file, fmt):
+        self.file = file
+        self.fmt = fmt
+        self.skipped = 0
+
+    def __iter__(self):
+        records = csv.DictReader(self.file) if self.fmt == 'csv' else self._json_records()
+        # Line 1 is the CSV header
+        for line, record in enumerate(records, 2 if self.fmt == 'csv' else 1):
+            try:
+                text = record['text']
+                if not text:
+                    raise ValueError("empty text")
+                yield (int(record['chat_id']), text, parse_due_at(record['due_at']), parse_repeat(record.get('repeat')),
+                       parse_optional_int(record.get('fired'), 0), parse_optional_int(record.get('acknowledged'), 0),
+                       parse_optional_int(record.get('id')))
+            except (KeyError, TypeError, ValueError) as e:
+                self.skipped += 1
+                if self.skipped <= MAX_LOGGED_ERRORS:
+                    logger.warning("Skipping line %d: %r", line, e)
+
+    def _json_records(self):
+        for line in self.file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield record if isinstance(record, dict) else {}
+
+
+# Function to insert a stream of ReminderReader rows in chunked transactions; returns
+# the number of rows inserted. Memory use is bounded by one chunk, however long the stream is.
+def import_rows(conn, rows, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    rows = iter(rows)
+    imported = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        with conn:
+            imported += conn.executemany(SQL_IMPORT_REMINDER, chunk).rowcount
+        if progress is not None:
+            progress(imported)
+    return imported
+
+
+# Function to import a CSV/JSONL file; returns (imported, skipped).
+# rebuild_indexes must only be used while the bot is not running, since listing
+# and scheduling queries fall back to table scans until the indexes are back.
+def import_file(conn, path, fmt=None, progress=None, rebuild_indexes=False):
+    fmt = fmt or detect_format(path)
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute(f"PRAGMA cache_size={BULK_CACHE_SIZE}")
+    if rebuild_indexes:
+        for name in REMINDERS_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        conn.commit()
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            reader = ReminderReader(file, fmt)
+            imported = import_rows(conn, reader, progress=progress)
+    finally:
+        if rebuild_indexes:
+            logger.info("Rebuilding reminder indexes")
+            for statement in REMINDERS_INDEXES_SQL:
+                conn.execute(statement)
+            conn.commit()
+        conn.execute(f"PRAGMA cache_size={cache_size}")
+    return imported, reader.skipped
+
+
+# Function to write every reminder to a CSV/JSONL file; returns the row count
+def export_file(conn, path, fmt=None, progress=None):
+    fmt = fmt or detect_format(path)
+    exported = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        if fmt == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(EXPORT_FIELDS)
+            write_rows = writer.writerows
+        else:
+            def write_rows(rows):
+                file.writelines(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + '\n'
+                                for row in rows)
+
+        cursor = conn.execute(SQL_EXPORT_REMINDERS)
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            write_rows(rows)
+            exported += len(rows)
+            if progress is not None:
+                progress(exported)
+    return exported
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Import or export reminders as CSV or JSONL. "
+                                                 "Imported reminders are scheduled the next time the bot starts.")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('file', help="a .csv, .jsonl or .ndjson file; CSV needs a chat_id,text,due_at[,repeat] header, "
+                                       "plus id,fired,acknowledged in exported files")
+    parser.add_argument('--db', default=storage.REMINDERS_DB_PATH)
+    parser.add_argument('--format', choices=['csv', 'jsonl'])
+    parser.add_argument('--rebuild-indexes', action='store_true',
+                        help="drop the indexes and rebuild them after the import; faster for large files, "
+                             "but only while the bot is not running")
+    args = parser.parse_args()
+
+    conn = storage.connect(args.db)
+    ensure_reminders_schema(conn)
+
+    def report(count):
+        logger.info("%sed %d reminders", args.action.capitalize(), count)
+
+    if args.action == 'import':
+        imported, skipped = import_file(conn, args.file, args.format, report, args.rebuild_indexes)
+        logger.info("Imported %d reminders from %s, skipped %d bad rows", imported, args.file, skipped)
+    else:
+        exported = export_file(conn, args.file, args.format, report)
+        logger.info("Exported %d reminders to %s", exported, args.file)
+    conn.close()
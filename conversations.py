@@ -0,0 +1,102 @@
+import logging
+import sys
+import time
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Seconds of inactivity after which a half-finished flow is dropped
+CONVERSATION_TTL = 3600
+# How often abandoned flows are swept out
+CONVERSATION_SWEEP_INTERVAL = 300
+
+
+# Where one user is in a multi-step flow, and what they have entered so far
+class Conversation:
+    __slots__ = ('state', 'text', 'updated_at')
+
+    def __init__(self, state, text, updated_at):
+        self.state = state
+        self.text = text
+        self.updated_at = updated_at
+
+
+# In-progress conversations keyed by user id. Only users in the middle of a
+# flow have an entry, and entries expire after `ttl` seconds without activity.
+# With persist=True every change is also written to the reminders database, so
+# flows survive a restart.
+class ConversationStore:
+    def __init__(self, ttl=CONVERSATION_TTL, persist=False, clock=time.time):
+        self.ttl = ttl
+        self.persist = persist
+        self.clock = clock
+        self.expired = 0
+        self._conversations = {}
+
+    # Function to restore persisted conversations, once at startup
+    def load(self):
+        now = self.clock()
+        for user_id, state, text, updated_at in storage.get_conversations(now - self.ttl):
+            self._conversations[user_id] = Conversation(state, text, updated_at)
+        logger.info("Restored %d conversations", len(self._conversations))
+
+    def get(self, user_id):
+        conversation = self._conversations.get(user_id)
+        if conversation is not None and conversation.updated_at + self.ttl <= self.clock():
+            self._expire(user_id)
+            return None
+        return conversation
+
+    def state(self, user_id):
+        conversation = self.get(user_id)
+        return conversation.state if conversation is not None else None
+
+    def set(self, user_id, state, text=None):
+        now = int(self.clock())
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            self._conversations[user_id] = Conversation(state, text, now)
+        else:
+            conversation.state = state
+            conversation.text = text
+            conversation.updated_at = now
+        if self.persist:
+            storage.save_conversation(user_id, state, text, now)
+
+    def clear(self, user_id):
+        if self._conversations.pop(user_id, None) is not None and self.persist:
+            storage.delete_conversation(user_id)
+
+    def _expire(self, user_id):
+        del self._conversations[user_id]
+        self.expired += 1
+
+    # Function to drop every conversation idle for longer than the TTL
+    def evict_expired(self):
+        cutoff = self.clock() - self.ttl
+        stale = [user_id for user_id, conversation in self._conversations.items()
+                 if conversation.updated_at <= cutoff]
+        for user_id in stale:
+            self._expire(user_id)
+        if self.persist:
+            storage.delete_expired_conversations(int(cutoff))
+        return len(stale)
+
+    def __len__(self):
+        return len(self._conversations)
+
+    # Memory held by the store: the dict, keys, state records and entered text.
+    # State names are shared constants and are not counted.
+    def stats(self):
+        total = sys.getsizeof(self._conversations)
+        for user_id, conversation in self._conversations.items():
+            total += sys.getsizeof(user_id) + sys.getsizeof(conversation)
+            if conversation.text is not None:
+                total += sys.getsizeof(conversation.text)
+        active = len(self._conversations)
+        return {
+            'active': active,
+            'expired': self.expired,
+            'bytes': total,
+            'bytes_per_conversation': total / active if active else 0.0,
+        }
@@ -0,0 +1,58 @@
+import math
+import threading
+from array import array
+
+# Width of one timing-wheel slot; follow-ups fire up to this many seconds late
+FOLLOW_UP_SLOT = 60
+
+
+# Timing wheel of pending follow-ups. Each slot is a packed array of reminder ids,
+# so an outstanding follow-up costs 8 bytes instead of a JobQueue job. Cancelled
+# reminders are not removed here; the batch lookup in the database skips them.
+class FollowUpWheel:
+    __slots__ = ('slot_seconds', '_slots', '_cursor', '_count', '_lock')
+
+    def __init__(self, slot_seconds=FOLLOW_UP_SLOT, now=0):
+        self.slot_seconds = slot_seconds
+        self._slots = {}
+        # Last slot handed out by pop_due
+        self._cursor = int(now // slot_seconds) - 1
+        self._count = 0
+        self._lock = threading.Lock()
+
+    # Queue a follow-up for a reminder at (or just after) the given timestamp
+    def add(self, reminder_id, at):
+        with self._lock:
+            # Round up so a follow-up never fires early; anything already overdue
+            # goes into the next slot to be processed
+            slot = max(math.ceil(at / self.slot_seconds), self._cursor + 1)
+            ids = self._slots.get(slot)
+            if ids is None:
+                ids = self._slots[slot] = array('q')
+            ids.append(reminder_id)
+            self._count += 1
+
+    # Remove and return the reminder ids of every slot that has started by `now`
+    def pop_due(self, now):
+        current = int(now // self.slot_seconds)
+        due = array('q')
+        with self._lock:
+            if current - self._cursor > len(self._slots):
+                # Long gap (startup or a stall): walk the occupied slots, not every slot
+                for slot in sorted(slot for slot in self._slots if slot <= current):
+                    due.extend(self._slots.pop(slot))
+            else:
+                for slot in range(self._cursor + 1, current + 1):
+                    ids = self._slots.pop(slot, None)
+                    if ids is not None:
+                        due.extend(ids)
+            self._cursor = max(self._cursor, current)
+            self._count -= len(due)
+        return due
+
+    def slot_count(self):
+        with self._lock:
+            return len(self._slots)
+
+    def __len__(self):
+        return self._count
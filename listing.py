@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Reminders shown per page of /myreminders and /deletereminder
+PAGE_SIZE = 10
+# Characters of reminder text shown per line, so a full page stays well under
+# Telegram's 4096-character message limit
+PAGE_TEXT_LIMIT = 120
+# Chats whose rendered pages are kept
+PAGE_CACHE_CHATS = 10000
+
+
+# Function to shorten reminder text for a listing line
+def shorten(text, limit=PAGE_TEXT_LIMIT):
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+# Rendered listing pages per chat, LRU over chats. A chat's pages are dropped
+# whenever one of its reminders is added, deleted or marked done. With `ttl`,
+# pages also expire that many seconds after they were rendered, for when
+# reminders change where invalidate() is not called (another process).
+class PageCache:
+    def __init__(self, max_chats=PAGE_CACHE_CHATS, ttl=None, clock=time.monotonic):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._chats = OrderedDict()
+        # chat_id -> value of `invalidations` when the chat was last invalidated,
+        # LRU over chats. Chats that fell out count as invalidated at `_floor`.
+        self._invalidated_at = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, chat_id, key):
+        with self._lock:
+            pages = self._chats.get(chat_id)
+            entry = pages.get(key) if pages is not None else None
+            if entry is not None and self.ttl is not None and self.clock() - entry[1] > self.ttl:
+                del pages[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._chats.move_to_end(chat_id)
+            self.hits += 1
+            return entry[0]
+
+    # Store a page rendered from data read at `version`. If the chat was
+    # invalidated meanwhile the page may be stale, so it is not kept; other
+    # chats' writes don't matter.
+    def put(self, chat_id, key, page, version):
+        with self._lock:
+            if self._invalidated_at.get(chat_id, self._floor) > version:
+                return
+            pages = self._chats.get(chat_id)
+            if pages is None:
+                pages = self._chats[chat_id] = {}
+            pages[key] = (page, self.clock())
+            self._chats.move_to_end(chat_id)
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+
+    # Taken before reading the reminders a page is rendered from
+    def version(self):
+        return self.invalidations
+
+    def invalidate(self, chat_id):
+        with self._lock:
+            self.invalidations += 1
+            self._chats.pop(chat_id, None)
+            self._invalidated_at[chat_id] = self.invalidations
+            self._invalidated_at.move_to_end(chat_id)
+            while len(self._invalidated_at) > self.max_chats:
+                _, invalidated_at = self._invalidated_at.popitem(last=False)
+                self._floor = max(self._floor, invalidated_at)
+
+    # Drop every chat's pages, e.g. after a bulk import
+    def clear(self):
+        with self._lock:
+            self.invalidations += 1
+            self._chats.clear()
+            self._invalidated_at.clear()
+            self._floor = self.invalidations
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'chats': len(self._chats),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
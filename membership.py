@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Seconds a "member" answer is trusted, and how long other answers are kept,
+# so a user who just joined only waits a few seconds before Restart works
+MEMBERSHIP_TTL = 600
+NEGATIVE_TTL = 5
+MEMBERSHIP_CACHE_SIZE = 100000
+
+
+# LRU cache of channel membership statuses keyed by (user_id, channel_id)
+class MembershipCache:
+    def __init__(self, ttl=MEMBERSHIP_TTL, negative_ttl=NEGATIVE_TTL, max_entries=MEMBERSHIP_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, channel_id):
+        key = (user_id, channel_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id, channel_id, status):
+        ttl = self.ttl if status == 'member' else self.negative_ttl
+        with self._lock:
+            self._entries[(user_id, channel_id)] = (status, time.monotonic() + ttl)
+            self._entries.move_to_end((user_id, channel_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Channel list from channel_info.json, re-read only when the file changes
+class ChannelList:
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._channel_ids = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.path, 'r') as file:
+                        channel_info = json.load(file)
+                    self._channel_ids = channel_info.get('channel_chat_ids', [])
+                    self._mtime = mtime
+                    logger.info("Loaded %d channels from %s", len(self._channel_ids), self.path)
+        return self._channel_ids
+
+
+# Function to look up one membership status through the Bot API
+async def _fetch_status(bot, channel_id, user_id):
+    try:
+        return (await bot.get_chat_member(channel_id, user_id)).status
+    except Exception:
+        logger.exception("get_chat_member failed for user %s in channel %s", user_id, channel_id)
+        return None
+
+
+# Function to check whether a user is a member of every channel.
+# Cached answers are used when fresh; the rest are fetched concurrently.
+async def is_member_of_all(bot, cache, user_id, channel_ids):
+    missing = []
+    for channel_id in channel_ids:
+        status = cache.get(user_id, channel_id)
+        if status is None:
+            missing.append(channel_id)
+        elif status != 'member':
+            return False
+
+    if not missing:
+        return True
+
+    statuses = await asyncio.gather(*(_fetch_status(bot, channel_id, user_id) for channel_id in missing))
+    is_member = True
+    for channel_id, status in zip(missing, statuses):
+        if status is not None:
+            cache.put(user_id, channel_id, status)
+        if status != 'member':
+            is_member = False
+    return is_member
@@ -0,0 +1,322 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Where /metrics is served; keep it on localhost, there is no authentication
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+
+# Histogram buckets in seconds: handler, query and API latency, and how late things run
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 300, 1800)
+
+# Seconds between stack samples while the profiler is on
+PROFILE_INTERVAL = 0.01
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+# One time series of a counter or gauge
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    # acquire/release is about three times cheaper than `with` here, and nothing between them can raise
+    def inc(self, amount=1):
+        self._lock.acquire()
+        self.value += amount
+        self._lock.release()
+
+    def set(self, value):
+        self.value = value
+
+
+# One time series of a histogram: a count per bucket plus the running sum
+class _Buckets:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        self._lock.acquire()
+        self.counts[i] += 1
+        self.sum += value
+        self._lock.release()
+
+
+# A named metric with optional labels. Unlabelled metrics are used directly
+# (metric.inc(), metric.observe(x)); labelled ones through metric.labels(...).
+# With `func`, the value is read by calling it at scrape time instead.
+class Metric:
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=None, func=None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self.func = func
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = _Buckets(self.buckets) if self.kind == 'histogram' else _Value()
+                    self._children[values] = child
+        return child
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if self.func is not None:
+            try:
+                lines.append(f"{self.name} {self.func()}")
+            except Exception as e:
+                logger.warning("Could not collect %s: %r", self.name, e)
+            return lines
+        for values, child in list(self._children.items()):
+            if self.kind != 'histogram':
+                lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {child.value}")
+                continue
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# Every metric the process exposes, in registration order
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    # Registering a name again replaces the old metric, so a module that defines
+    # metrics can be loaded more than once (the benchmarks load the bot script)
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), func=None):
+        return self._add(Metric('counter', name, documentation, labelnames, func=func))
+
+    def gauge(self, name, documentation, labelnames=(), func=None):
+        return self._add(Metric('gauge', name, documentation, labelnames, func=func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Metric('histogram', name, documentation, labelnames, buckets=buckets))
+
+    # Function to render every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+# Function to decorate a function or coroutine function so every call is
+# observed in `histogram`, e.g. @timed(DB_QUERY_SECONDS, 'get_reminder')
+def timed(histogram, *labels):
+    series = histogram.labels(*labels)
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    series.observe(time.perf_counter() - start)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    series.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# Statistical profiler: a background thread samples every thread's stack each
+# `interval` seconds and counts identical stacks. Off until started, so it costs
+# nothing in normal operation. Output is in the folded format flamegraph tools read.
+class SamplingProfiler:
+    def __init__(self):
+        self.interval = PROFILE_INTERVAL
+        self.samples = 0
+        self.started_at = None
+        self._stacks = defaultdict(int)
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self._thread is not None
+
+    # Function to start sampling; previous samples are discarded
+    def start(self, interval=PROFILE_INTERVAL):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.interval = interval
+            self.samples = 0
+            self.started_at = time.time()
+            self._stacks = defaultdict(int)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+        logger.info("Profiler started, sampling every %.3fs", interval)
+        return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join()
+        logger.info("Profiler stopped after %d samples", self.samples)
+        return True
+
+    # Function to return the samples so far as "frame;frame;frame count" lines, busiest first
+    def folded(self):
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: item[1], reverse=True)
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ';'.join(reversed(stack))
+                with self._lock:
+                    self._stacks[key] += 1
+            self.samples += 1
+
+
+profiler = SamplingProfiler()
+
+
+# Minimal HTTP server for scrapes and profiler control:
+#   GET  /metrics                 Prometheus text format
+#   POST /profile/start?interval= start the sampling profiler
+#   POST /profile/stop            stop it
+#   GET  /profile                 folded stacks collected so far
+class MetricsServer:
+    def __init__(self, registry=registry, profiler=profiler):
+        self.registry = registry
+        self.profiler = profiler
+        self.port = None
+        self._server = None
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT):
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Metrics on http://%s:%d/metrics", host, self.port)
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self.profiler.stop()
+
+    def _respond(self, method, target):
+        url = urlsplit(target)
+        if url.path == '/metrics' and method == 'GET':
+            return 200, 'text/plain; version=0.0.4', self.registry.render()
+        if url.path == '/profile' and method == 'GET':
+            return 200, 'text/plain', self.profiler.folded()
+        if url.path == '/profile/start' and method == 'POST':
+            interval = float(parse_qs(url.query).get('interval', [PROFILE_INTERVAL])[0])
+            started = self.profiler.start(interval)
+            return 200, 'text/plain', "started\n" if started else "already running\n"
+        if url.path == '/profile/stop' and method == 'POST':
+            stopped = self.profiler.stop()
+            return 200, 'text/plain', f"stopped, {self.profiler.samples} samples\n" if stopped else "not running\n"
+        return 404, 'text/plain', "not found\n"
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            # Headers and any body are not needed
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            try:
+                status, content_type, body = self._respond(method, target)
+            except ValueError as e:
+                status, content_type, body = 400, 'text/plain', f"{e}\n"
+            payload = body.encode()
+            reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}[status]
+            writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
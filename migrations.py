@@ -0,0 +1,164 @@
+import sqlite3
+import logging
+import datetime
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Compact reminders schema: due times are INTEGER UTC epoch seconds, and the
+# scheduler state (fired, follow-ups sent, next follow-up, acknowledged) lives
+# next to each reminder so it survives restarts. A repeating reminder is one
+# row whose due_at is moved to the next occurrence each time it fires.
+REMINDERS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS {name}
+                         (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL,
+                          text TEXT NOT NULL, due_at INTEGER NOT NULL,
+                          fired INTEGER NOT NULL DEFAULT 0, follow_ups INTEGER NOT NULL DEFAULT 0,
+                          next_follow_up_at INTEGER, acknowledged INTEGER NOT NULL DEFAULT 0,
+                          repeat TEXT, fired_due_at INTEGER, fired_at REAL)'''
+
+# Columns added after the due_at migration, with their definitions
+REMINDERS_STATE_COLUMNS = [
+    ('fired', "INTEGER NOT NULL DEFAULT 0"),
+    ('follow_ups', "INTEGER NOT NULL DEFAULT 0"),
+    ('next_follow_up_at', "INTEGER"),
+    ('acknowledged', "INTEGER NOT NULL DEFAULT 0"),
+    ('repeat', "TEXT"),
+    # Due time and actual send time of the latest firing
+    ('fired_due_at', "INTEGER"),
+    ('fired_at', "REAL"),
+]
+
+REMINDERS_INDEXES_SQL = [
+    # Keyset pagination of a chat's pending reminders in (due_at, id) order;
+    # replaces the (chat_id, due_at) index it covers
+    "CREATE INDEX IF NOT EXISTS idx_reminders_chat_page ON reminders (chat_id, due_at, id) WHERE acknowledged = 0",
+    "DROP INDEX IF EXISTS idx_reminders_chat_due_at",
+    # Startup rebuild reads only reminders that are still pending. It replaces
+    # the full (due_at) index, which no query uses since the due-time heap.
+    "CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders (due_at) WHERE acknowledged = 0",
+    "DROP INDEX IF EXISTS idx_reminders_due_at",
+]
+
+# Number of rows converted per transaction while backfilling due_at
+MIGRATION_BATCH_SIZE = 5000
+
+# The old bot kept a reminder until Done and followed it up every 30 minutes, so
+# a reminder already due when the state columns arrive has been sent. It is
+# marked fired, and its follow-ups carry on this long after the upgrade.
+LEGACY_FOLLOW_UP_DELAY = 1800
+
+
+# Function to parse a legacy TEXT reminder date, with or without seconds
+def parse_legacy_date(date_str):
+    try:
+        return datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        # If seconds are not present, try without seconds
+        return datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M")
+
+
+# Function to convert a legacy date string (naive local time) to epoch seconds
+def legacy_date_to_epoch(date_str):
+    try:
+        return int(parse_legacy_date(date_str).timestamp())
+    except (TypeError, ValueError):
+        logger.warning("Unparseable reminder date %r, treating it as already due", date_str)
+        return 0
+
+
+# Function to create or upgrade the reminders table to the due_at schema
+def ensure_reminders_schema(conn):
+    conn.execute(REMINDERS_TABLE_SQL.format(name='reminders'))
+    conn.commit()
+    migrate_reminders_due_at(conn)
+    migrate_reminders_state(conn)
+    for statement in REMINDERS_INDEXES_SQL:
+        conn.execute(statement)
+    conn.commit()
+
+
+# One-shot migration of the TEXT date column to INTEGER due_at.
+# Safe to interrupt: the backfill commits in batches and picks up where it
+# stopped, and the final table swap runs in a single transaction.
+def migrate_reminders_due_at(conn, batch_size=MIGRATION_BATCH_SIZE):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(reminders)")}
+    if 'date' not in columns:
+        return False
+
+    if 'due_at' not in columns:
+        conn.execute("ALTER TABLE reminders ADD COLUMN due_at INTEGER")
+        conn.commit()
+
+    # Backfill due_at in primary key order, one batch per transaction
+    last_id = 0
+    converted = 0
+    while True:
+        rows = conn.execute("SELECT id, date FROM reminders WHERE id > ? AND due_at IS NULL ORDER BY id LIMIT ?",
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        conn.executemany("UPDATE reminders SET due_at = ? WHERE id = ?",
+                         [(legacy_date_to_epoch(date_str), reminder_id) for reminder_id, date_str in rows])
+        conn.commit()
+        last_id = rows[-1][0]
+        converted += len(rows)
+        logger.info("Converted %d reminder dates to due_at", converted)
+
+    # The legacy table allowed NULL chat_id and text, the compact one does not.
+    # A reminder without a chat can never be sent, so it is left behind; one
+    # without text keeps an empty text.
+    for (reminder_id,) in conn.execute("SELECT id FROM reminders WHERE chat_id IS NULL"):
+        logger.warning("Reminder %d has no chat_id, dropping it", reminder_id)
+    for (reminder_id,) in conn.execute("SELECT id FROM reminders WHERE text IS NULL AND chat_id IS NOT NULL"):
+        logger.warning("Reminder %d has no text, keeping it with an empty text", reminder_id)
+
+    # Swap in the compact table, keeping ids and the AUTOINCREMENT counter
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'reminders'").fetchone()
+    sequence = row[0] if row else 0
+    now = int(time.time())
+    try:
+        conn.executescript(f'''
+            BEGIN;
+            DROP TABLE IF EXISTS reminders_new;
+            {REMINDERS_TABLE_SQL.format(name='reminders_new')};
+            INSERT INTO reminders_new (id, chat_id, text, due_at, fired, fired_due_at, next_follow_up_at)
+                SELECT id, chat_id, coalesce(text, ''), due_at, due_at <= {now},
+                       CASE WHEN due_at <= {now} THEN due_at END,
+                       CASE WHEN due_at <= {now} THEN {now + LEGACY_FOLLOW_UP_DELAY} END
+                FROM reminders WHERE chat_id IS NOT NULL;
+            DROP TABLE reminders;
+            ALTER TABLE reminders_new RENAME TO reminders;
+            UPDATE sqlite_sequence SET seq = max(seq, {int(sequence)}) WHERE name = 'reminders';
+            COMMIT;
+        ''')
+    except sqlite3.Error:
+        # Don't leave the swap's transaction open and the database locked
+        conn.rollback()
+        raise
+    logger.info("Migrated reminders table to due_at schema")
+    return True
+
+
+# Function to add the scheduler state columns to a due_at-era reminders table
+def migrate_reminders_state(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(reminders)")}
+    added = False
+    for name, definition in REMINDERS_STATE_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE reminders ADD COLUMN {name} {definition}")
+            added = True
+    if 'fired' not in columns:
+        now = int(time.time())
+        conn.execute("UPDATE reminders SET fired = 1, fired_due_at = due_at, next_follow_up_at = ? WHERE due_at <= ?",
+                     (now + LEGACY_FOLLOW_UP_DELAY, now))
+    conn.commit()
+    if added:
+        logger.info("Added scheduler state columns to reminders table")
+    return added
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else 'reminders.db'
+    ensure_reminders_schema(sqlite3.connect(path))
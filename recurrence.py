@@ -0,0 +1,35 @@
+import datetime
+
+# Repeat rules a reminder can have, stored in reminders.repeat, and the days
+# between occurrences. Occurrences keep their local wall-clock time across DST.
+REPEAT_DAYS = {'daily': 1, 'weekdays': 1, 'weekly': 7}
+REPEAT_RULES = tuple(REPEAT_DAYS)
+
+
+# Function to check a repeat rule typed by a user or read from an import file
+def parse_repeat(value):
+    if value is None or value == '':
+        return None
+    rule = str(value).strip().lower()
+    if rule not in REPEAT_DAYS:
+        raise ValueError(f"Unknown repeat rule {value!r}, expected one of {', '.join(REPEAT_RULES)}")
+    return rule
+
+
+# Function to compute the first occurrence of a repeating reminder after `after`,
+# starting from the occurrence at `due_at`. Only the next occurrence is ever
+# computed; occurrences missed while the bot was down are jumped over in one
+# step instead of being walked one by one.
+def next_occurrence(rule, due_at, after):
+    step = REPEAT_DAYS[rule]
+    due = datetime.datetime.fromtimestamp(due_at)
+    missed = (datetime.datetime.fromtimestamp(after).date() - due.date()).days // step
+    if missed > 1:
+        due += datetime.timedelta(days=(missed - 1) * step)
+    while True:
+        due += datetime.timedelta(days=step)
+        if rule == 'weekdays' and due.weekday() >= 5:
+            continue
+        due_at = int(due.timestamp())
+        if due_at > after:
+            return due_at
@@ -1,204 +1,490 @@
-import sqlite3
+import argparse
+import asyncio
 import logging
 import datetime
-import threading
-import schedule
+import os
+import signal
+import tempfile
 import time
-import json
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update, ParseMode
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackQueryHandler, CallbackContext
+import storage
+import bulk
+import metrics
+import webhook
+from membership import MembershipCache, ChannelList, is_member_of_all
+from sender import SendQueue, GLOBAL_RATE, PRIORITY_REMINDER, PRIORITY_FOLLOW_UP
+from followups import FollowUpWheel, FOLLOW_UP_SLOT
+from scheduler import DueHeap, FiringEngine, MAX_CATCH_UP
+from listing import PageCache, PAGE_SIZE, shorten
+from router import Router, encode_callback
+from conversations import ConversationStore, CONVERSATION_SWEEP_INTERVAL
+from recurrence import REPEAT_RULES, next_occurrence, parse_repeat
+from sharding import LeaseManager, SHARD_COUNT, LEASE_RENEW_INTERVAL
+from webhook import ChatOrderedUpdateProcessor, WebhookServer
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import ParseMode
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, CallbackContext
+from telegram.request import HTTPXRequest
 
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
-
-# Global dictionary to store reminder jobs
-reminder_jobs = {}
-
-# Function to create a thread-local SQLite connection for reminders.db
-def get_db_connection():
-    if not hasattr(thread_local, "db"):
-        thread_local.db = sqlite3.connect('reminders.db', check_same_thread=False)
-        thread_local.db.execute('''CREATE TABLE IF NOT EXISTS reminders
-                                  (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, text TEXT, date TEXT)''')
-        thread_local.db.commit()
-    return thread_local.db
-
-# Function to create a thread-local SQLite connection for channels.db
-def get_channels_db_connection():
-    if not hasattr(thread_local, "channels_db"):
-        thread_local.channels_db = sqlite3.connect('channels.db', check_same_thread=False)
-        thread_local.channels_db.execute('''CREATE TABLE IF NOT EXISTS channels
-                                          (id INTEGER PRIMARY KEY AUTOINCREMENT, link TEXT)''')
-        thread_local.channels_db.commit()
-    return thread_local.channels_db
-
-def get_reminders_db_connection():
-    if not hasattr(thread_local, "reminders_db"):
-        thread_local.reminders_db = sqlite3.connect('reminders.db', check_same_thread=False)
-        thread_local.reminders_db.execute('''CREATE TABLE IF NOT EXISTS reminders
-                                  (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, text TEXT, date TEXT)''')
-        thread_local.reminders_db.commit()
-    return thread_local.reminders_db
-
-# SQLite database initialization
-thread_local = threading.local()
-
-def add_channel(update, context):
+# One INFO line per Bot API request or job run is too much at this volume
+logging.getLogger('httpx').setLevel(logging.WARNING)
+logging.getLogger('apscheduler').setLevel(logging.WARNING)
+
+# Due-time index of pending reminders, loaded once at startup
+due_heap = DueHeap()
+
+# Fires the reminders in due_heap at their due time; started in processes that send reminders
+firing_engine = None
+
+# Seconds before a reminder whose send failed is tried again. It keeps its due
+# time, so once it is MAX_CATCH_UP late it is handled as missed instead.
+SEND_RETRY_DELAY = 60
+
+# Time between follow-ups of an unacknowledged reminder
+FOLLOW_UP_INTERVAL = 1800  # 30 minutes in seconds
+
+# Stop following up after this many follow-ups (None keeps going until Done)
+MAX_FOLLOW_UPS = None
+
+# Pending follow-ups of fired reminders, sent in one batch per wheel slot
+follow_up_wheel = FollowUpWheel(now=time.time())
+
+# Wait for reminder writes to be committed before confirming them to the user
+DURABLE_WRITES = True
+
+# Updates handled at the same time; each one is a coroutine, not a thread.
+# Further updates wait in the application's queue, which is cheaper than a long
+# queue of requests inside the HTTP connection pool. One chat's updates run one
+# after another, since its conversation state is set by the update before.
+CONCURRENT_UPDATES = 32
+
+# Rendered /myreminders and /deletereminder pages, dropped when a chat's reminders change
+page_cache = PageCache()
+# Seconds an ingress keeps a rendered page. Workers move repeating reminders on
+# to their next occurrence without telling the ingress, so its pages expire.
+INGRESS_PAGE_CACHE_TTL = 10
+
+# Callback data codes, encoded as "1:<code>:<args>" by router.encode_callback
+CB_DONE = 'd'
+CB_DELETE = 'x'
+CB_PAGE = 'p'
+CB_REMOVE_CHANNEL = 'c'
+CB_SET_REMINDER = 's'
+CB_MY_REMINDERS = 'm'
+CB_RESTART = 'r'
+
+# Conversation states, used to route text messages
+STATE_CHANNEL_LINK = 'channel_link'
+STATE_REMINDER_TEXT = 'reminder_text'
+STATE_REMINDER_DATE = 'reminder_date'
+STATE_IMPORT_FILE = 'import_file'
+
+# Keep half-finished flows in the database so they survive a restart
+PERSIST_CONVERSATIONS = True
+
+# Users in the middle of a flow, loaded in on_startup
+conversations = ConversationStore(persist=PERSIST_CONVERSATIONS)
+
+# Rate-limited outbound queue for reminder messages, started in on_startup
+send_queue = None
+
+# Process role: 'all' runs everything in one process. To use more than one core,
+# run one 'ingress' process (polling and handlers) next to N 'worker' processes
+# (scheduler and sender); each worker fires the reminders of the shards it holds a lease on.
+ROLE = 'all'
+WORKER_INDEX = 0
+WORKER_COUNT = 1
+
+# Seconds between a worker's reads of the reminders the ingress process added
+NEW_REMINDER_POLL_INTERVAL = 1
+
+# Shard leases of a worker process, None when one process does everything
+leases = None
+
+# Highest reminder id a worker has read, so each poll only reads reminders added since
+last_reminder_id = 0
+
+# Webhook mode: Telegram posts updates to an embedded server instead of the bot
+# polling for them. WEBHOOK_URL is the public HTTPS address that reaches
+# WEBHOOK_HOST:WEBHOOK_PORT; without it the server runs but is not registered
+# with Telegram, which is enough to post recorded updates to it locally.
+WEBHOOK_ENABLED = False
+WEBHOOK_URL = None
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_HOST = webhook.WEBHOOK_HOST
+WEBHOOK_PORT = webhook.WEBHOOK_PORT
+WEBHOOK_WORKERS = CONCURRENT_UPDATES
+webhook_server = None
+
+# Seconds between progress edits of the status message during /importreminders and /exportreminders
+BULK_PROGRESS_INTERVAL = 3
+
+# Serve metrics and the profiler switch on http://METRICS_HOST:METRICS_PORT while the bot runs
+METRICS_ENABLED = True
+METRICS_HOST = metrics.METRICS_HOST
+METRICS_PORT = metrics.METRICS_PORT
+metrics_server = None
+
+HANDLER_SECONDS = metrics.registry.histogram('bot_handler_seconds', "Time to handle an update", ['handler'])
+API_SECONDS = metrics.registry.histogram('bot_telegram_api_seconds', "Time of a Bot API request", ['method'])
+TICK_SECONDS = metrics.registry.histogram('bot_scheduler_tick_seconds', "Duration of a scheduler job run", ['job'])
+FIRE_LATENESS_SECONDS = metrics.registry.histogram('bot_reminder_fire_lateness_seconds',
+                                                   "How long after its due time a reminder was handed to the send queue",
+                                                   buckets=metrics.LAG_BUCKETS)
+REMINDER_LAG_SECONDS = metrics.registry.histogram('bot_reminder_lag_seconds', "How long after its due time a reminder was sent",
+                                                  buckets=metrics.LAG_BUCKETS)
+
+# Gauges and counters that already exist as state are read at scrape time, so they cost nothing in between
+metrics.registry.gauge('bot_send_queue_depth', "Messages queued or being sent",
+                       func=lambda: send_queue.depth() if send_queue is not None else 0)
+metrics.registry.counter('bot_messages_sent_total', "Messages sent by the send queue",
+                         func=lambda: send_queue.sent if send_queue is not None else 0)
+metrics.registry.counter('bot_messages_failed_total', "Messages the send queue gave up on",
+                         func=lambda: send_queue.failed if send_queue is not None else 0)
+metrics.registry.counter('bot_rate_limited_total', "429 responses from Telegram",
+                         func=lambda: send_queue.rate_limited if send_queue is not None else 0)
+metrics.registry.gauge('bot_scheduled_reminders', "Reminders in the due heap", func=lambda: len(due_heap))
+metrics.registry.counter('bot_reminders_fired_total', "Reminders the firing engine found due",
+                         func=lambda: firing_engine.fired if firing_engine is not None else 0)
+metrics.registry.counter('bot_reminders_caught_up_total', "Reminders fired late after a stall, restart or takeover",
+                         func=lambda: firing_engine.caught_up if firing_engine is not None else 0)
+metrics.registry.counter('bot_reminders_missed_total', "Reminders skipped for being too far overdue",
+                         func=lambda: firing_engine.missed if firing_engine is not None else 0)
+metrics.registry.counter('bot_firing_stalls_total', "Times the firing loop woke up late",
+                         func=lambda: firing_engine.stalls if firing_engine is not None else 0)
+metrics.registry.counter('bot_clock_steps_total', "Wall clock steps seen by the firing loop",
+                         func=lambda: firing_engine.clock_steps if firing_engine is not None else 0)
+metrics.registry.gauge('bot_pending_follow_ups', "Follow-ups on the timing wheel", func=lambda: len(follow_up_wheel))
+metrics.registry.gauge('bot_owned_shards', "Shards this worker holds a lease on",
+                       func=lambda: len(leases.owned()) if leases is not None else SHARD_COUNT)
+metrics.registry.gauge('bot_webhook_pending_updates', "Updates accepted by the webhook and not handled yet",
+                       func=lambda: webhook_server.queue.pending if webhook_server is not None else 0)
+metrics.registry.gauge('bot_active_conversations', "Users in the middle of a flow", func=lambda: len(conversations))
+metrics.registry.counter('bot_page_cache_hits_total', "Listing pages served from the cache",
+                         func=lambda: page_cache.hits)
+metrics.registry.counter('bot_page_cache_misses_total', "Listing pages rendered from the database",
+                         func=lambda: page_cache.misses)
+metrics.registry.counter('bot_membership_cache_hits_total', "Channel membership answers served from the cache",
+                         func=lambda: membership_cache.hits)
+metrics.registry.counter('bot_membership_cache_misses_total', "Channel membership lookups sent to Telegram",
+                         func=lambda: membership_cache.misses)
+
+async def add_channel(update, context):
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
 
     # Check if the user is an admin
     if user_id in ADMIN_CHAT_IDS:
-        update.message.reply_text("Please provide the link to the Telegram channel.")
+        await update.message.reply_text("Please provide the link to the Telegram channel.")
         # Set the state to wait for the channel link
-        context.user_data['waiting_for_channel_link'] = True
+        conversations.set(user_id, STATE_CHANNEL_LINK)
     else:
-        update.message.reply_text("You are not authorized to use this command.")
-
-# Function to add a reminder to the database
-def add_reminder(chat_id, text, date):
-    conn = get_db_connection()
-    conn.execute("INSERT INTO reminders (chat_id, text, date) VALUES (?, ?, ?)", (chat_id, text, date))
-    conn.commit()
-
-# Function to handle "/myreminders" command
-def my_reminders(update, context):
-    chat_id = update.callback_query.message.chat_id
-    reminders = get_reminders(chat_id)
+        await update.message.reply_text("You are not authorized to use this command.")
+
+# Function to add a reminder to the database; `repeat` is one of REPEAT_RULES or None
+async def add_reminder(chat_id, text, date, repeat=None):
+    due_at = int(date.timestamp())
+    future = storage.add_reminder(chat_id, text, due_at, repeat)
+    # The id is only known once the batch is committed
+    def on_commit(f):
+        page_cache.invalidate(chat_id)
+        # With separate workers, the worker that owns the chat picks the reminder up on its next poll
+        if f.exception() is None and ROLE == 'all':
+            due_heap.push(f.result(), due_at)
+            firing_engine.wake(due_at)
+
+    future.add_done_callback(on_commit)
+    if DURABLE_WRITES:
+        await storage.wait_for_write(future)
+
+# Function to format a due_at epoch as local time for display
+def format_due_at(due_at):
+    return datetime.datetime.fromtimestamp(due_at).strftime("%Y-%m-%d %H:%M")
+
+# Function to load the due-time index from the database, once at startup
+def load_due_heap():
+    due_heap.load(storage.get_due_index())
+    logger.info("Loaded %d reminders into the scheduler", len(due_heap))
+
+# Function to put follow-ups of fired but unacknowledged reminders back on the wheel after a restart
+def restore_follow_ups():
+    rows = storage.get_follow_up_state()
+    for reminder_id, next_follow_up_at in rows:
+        # Follow-ups that fell due while the bot was down are sent once, in the first slot
+        follow_up_wheel.add(reminder_id, next_follow_up_at)
+    logger.info("Restored follow-ups for %d reminders", len(rows))
+
+# Function to check whether this process fires the reminders of a chat
+def owns_chat(chat_id):
+    return leases is None or leases.owns(chat_id)
+
+# Function to check whether a chat's reminders must wait for the next lease round
+# instead of being dropped: our lease on its shard lapsed but no one took it over
+def lease_lapsed(chat_id):
+    return leases is not None and leases.lapsed(chat_id)
+
+# Function to try (reminder_id, due_at) rows again after the next lease round
+def defer_reminders(rows):
+    if rows:
+        asyncio.get_running_loop().call_later(LEASE_RENEW_INTERVAL, schedule_reminders, rows)
+
+# Function to add (reminder_id, due_at) rows to the due-time index, waking the firing engine if one is due sooner
+def schedule_reminders(rows):
+    rows = list(rows)
+    due_heap.extend(rows)
+    if rows and firing_engine is not None:
+        firing_engine.wake(min(due_at for _, due_at in rows))
+
+# Function to pick up reminders the ingress process added since the last poll
+async def load_new_reminders(context: CallbackContext):
+    global last_reminder_id
+    rows = await storage.run_db(storage.get_new_reminders, last_reminder_id)
+    if rows:
+        last_reminder_id = max(last_reminder_id, max(row[0] for row in rows))
+        schedule_reminders((reminder_id, due_at) for reminder_id, chat_id, due_at in rows
+                           if owns_chat(chat_id) or lease_lapsed(chat_id))
+
+# Function to renew this worker's shard leases and load the shards it took over
+async def renew_leases(context: CallbackContext):
+    gained, lost = await storage.run_db(leases.renew)
+    if gained:
+        await take_over_shards(gained)
+
+# Function to load the pending reminders and follow-ups of newly owned shards.
+# Reminders that fell due while no one held the shard (e.g. its worker
+# crashed) are caught up by the firing engine like after any other stall.
+async def take_over_shards(shards):
+    now = time.time()
+    rows = await storage.run_db(storage.get_shard_due_index, sorted(shards), SHARD_COUNT)
+    schedule_reminders(rows)
+
+    follow_ups = await storage.run_db(storage.get_shard_follow_up_state, sorted(shards), SHARD_COUNT)
+    for reminder_id, next_follow_up_at in follow_ups:
+        follow_up_wheel.add(reminder_id, next_follow_up_at)
+    logger.info("Took over %d reminders (%d overdue) and %d follow-ups",
+                len(rows), sum(1 for _, due in rows if due <= now), len(follow_ups))
+
+# Headings of the two reminder listings: 'l' is /myreminders, 'd' is /deletereminder
+LISTING_TITLES = {'l': "Your reminders:", 'd': "Select a reminder to delete:"}
+LISTING_EMPTY = {'l': "You have no reminders.", 'd': "You have no reminders to delete."}
+
+# Function to render one page of a chat's reminders as (text, reply_markup).
+# Pages are read with a keyset query, so the cost does not grow with the number of reminders.
+async def render_reminder_page(chat_id, view, cursor=None):
+    key = (view, cursor)
+    page = page_cache.get(chat_id, key)
+    if page is not None:
+        return page
+
+    version = page_cache.version()
+    reminders, has_prev, has_next = await storage.run_db(storage.get_reminder_page, chat_id, cursor, PAGE_SIZE)
+    if not reminders and cursor is not None:
+        # Everything on that side of the cursor is gone; start over from the first page
+        return await render_reminder_page(chat_id, view)
 
     if not reminders:
-        context.bot.send_message(chat_id=chat_id, text="You have no reminders.")
+        page = (LISTING_EMPTY[view], None)
     else:
         keyboard = []
-        for reminder_id, text, date in reminders:
-            keyboard.append([InlineKeyboardButton(f"Delete {reminder_id}", callback_data=f'delete_{reminder_id}')])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        message_text = "Your reminders:\n"
-        for reminder_id, text, date in reminders:
-            message_text += f"{reminder_id}. {text} - {date}\n"
-
-        context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
-
-# Function to get reminders for a specific chat
-def get_reminders(chat_id):
-    conn = get_db_connection()
-    cursor = conn.execute("SELECT id, text, date FROM reminders WHERE chat_id = ?", (chat_id,))
-    return cursor.fetchall()
+        message_text = LISTING_TITLES[view] + "\n"
+        for reminder_id, text, due_at, repeat in reminders:
+            keyboard.append([InlineKeyboardButton(f"Delete {reminder_id}", callback_data=encode_callback(CB_DELETE, reminder_id))])
+            if view == 'l':
+                repeat_note = f" ({repeat})" if repeat else ""
+                message_text += f"{reminder_id}. {shorten(text)} - {format_due_at(due_at)}{repeat_note}\n"
+
+        navigation = []
+        if has_prev:
+            first_id, _, first_due_at, _ = reminders[0]
+            navigation.append(InlineKeyboardButton(
+                "« Prev", callback_data=encode_callback(CB_PAGE, view, 'p', first_due_at, first_id)))
+        if has_next:
+            last_id, _, last_due_at, _ = reminders[-1]
+            navigation.append(InlineKeyboardButton(
+                "Next »", callback_data=encode_callback(CB_PAGE, view, 'n', last_due_at, last_id)))
+        if navigation:
+            keyboard.append(navigation)
+        page = (message_text, InlineKeyboardMarkup(keyboard))
+
+    page_cache.put(chat_id, key, page, version)
+    return page
 
-def send_reminder(context: CallbackContext):
-    job = context.job
-    chat_id = job.context['chat_id']
-    reminder_id = job.context['reminder_id']
-    text = job.context['text']
+# Function to handle "/myreminders" command
+async def my_reminders(update, context):
+    chat_id = update.effective_chat.id
+    message_text, reply_markup = await render_reminder_page(chat_id, 'l')
+    await context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
+
+# Function to handle the "My Reminders" button
+async def my_reminders_button(update, context):
+    await update.callback_query.answer()
+    await my_reminders(update, context)
+
+# Function to handle the Prev/Next buttons: show another page in place of the current one
+async def page_button(update, context, view, direction, due_at, reminder_id):
+    query = update.callback_query
+    await query.answer()
+
+    cursor = ('next' if direction.startswith('n') else 'prev', int(due_at), int(reminder_id))
+    message_text, reply_markup = await render_reminder_page(query.message.chat_id, view, cursor)
+    await query.edit_message_text(message_text, reply_markup=reply_markup)
+
+# Function to send the reminders the firing engine found due, given as (reminder_id, due_at) rows.
+# Reminders overdue after a stall, a restart or a takeover come through here as well.
+@metrics.timed(TICK_SECONDS, 'fire_reminders')
+async def fire_reminders(due):
+    due_at = dict(due)
+    deferred = []
+    # Deleted, acknowledged and already fired reminders drop out here
+    for reminder_id, chat_id, text, repeat in await storage.run_db(storage.get_firing_batch, list(due_at)):
+        if not owns_chat(chat_id):
+            # The shard moved to another worker, which sends it instead
+            if lease_lapsed(chat_id):
+                deferred.append((reminder_id, due_at[reminder_id]))
+            continue
+        send_reminder(chat_id, reminder_id, text, due_at[reminder_id], repeat)
+    defer_reminders(deferred)
+
+# Function to hand one reminder to the send queue
+def send_reminder(chat_id, reminder_id, text, due_at, repeat):
+    FIRE_LATENESS_SECONDS.observe(max(0.0, time.time() - due_at))
 
     message_text = f"{text}\nReminder ({reminder_id})"
-    keyboard = [[InlineKeyboardButton("Done", callback_data=f'done_{reminder_id}')]]
+    keyboard = [[InlineKeyboardButton("Done", callback_data=encode_callback(CB_DONE, reminder_id))]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
-
-def check_and_schedule_reminders(context: CallbackContext):
-    now = datetime.datetime.now()
-    conn = get_db_connection()
-    cursor = conn.execute("SELECT id, chat_id, text, date FROM reminders")
-
-    for row in cursor.fetchall():
-        reminder_id, chat_id, text, date_str = row
-        try:
-            date = datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        except ValueError:
-            # If seconds are not present, try without seconds
-            date = datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M")
-
-        time_difference = (date - now).total_seconds()
-
-        if 0 < time_difference <= 1800:  # If the time is within 30 minutes
-            # Check if the reminder has already been scheduled
-            if reminder_id not in reminder_jobs:
-                # Schedule the initial reminder using run_once
-                job_context = {'chat_id': chat_id, 'reminder_id': reminder_id, 'text': text}
-                # Set the job name using 'name' parameter
-                context.job_queue.run_once(send_reminder, time_difference, context=job_context, name=f"reminder_{reminder_id}")
-                
-                # Schedule the follow-up reminder 30 minutes later using run_repeating
-                reminder_jobs[reminder_id] = context.job_queue.run_repeating(
-                    send_follow_up,
-                    interval=1800,  # 30 minutes in seconds
-                    first=1800,  # Initial delay of 30 minutes for repeating reminders
-                    context=job_context,
-                    name=f"reminder_{reminder_id}"
-                )
-
-# Function to send follow-up reminders
-def send_follow_up(context: CallbackContext):
-    job = context.job
-    chat_id = job.context['chat_id']
-    reminder_id = job.context['reminder_id']
-    text = job.context['text']
-
-    message_text = f"{text}\nReminder ({reminder_id}) Follow-Up"
-    keyboard = [[InlineKeyboardButton("Done", callback_data=f'done_{reminder_id}')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    sent = send_queue.send(chat_id, priority=PRIORITY_REMINDER, text=message_text, reply_markup=reply_markup)
+    # Record the firing once the message has been delivered, so a worker that
+    # dies with it still queued leaves it unfired for the next owner of the shard
+    def on_sent(f):
+        if f.cancelled():
+            return
+        if f.exception() is not None:
+            asyncio.get_running_loop().call_later(SEND_RETRY_DELAY, schedule_reminders, [(reminder_id, due_at)])
+            return
+        record_firing(chat_id, reminder_id, due_at, repeat)
+
+    sent.add_done_callback(on_sent)
+
+# Function to record a sent reminder, with its due and actual send time, so a
+# restart neither repeats it nor forgets the follow-ups
+def record_firing(chat_id, reminder_id, due_at, repeat):
+    fired_at = time.time()
+    REMINDER_LAG_SECONDS.observe(max(0.0, fired_at - due_at))
+    now = int(fired_at)
+    # With MAX_FOLLOW_UPS = 0 the reminder itself is the only message
+    next_follow_up_at = now + FOLLOW_UP_INTERVAL if MAX_FOLLOW_UPS != 0 else None
+    if repeat:
+        # Only the next occurrence is computed, and the same row moves on to it
+        next_due_at = next_occurrence(repeat, due_at, now)
+        future = storage.advance_repeating(reminder_id, next_due_at, next_follow_up_at, fired_at)
+        future.add_done_callback(lambda f: page_cache.invalidate(chat_id))
+        due_heap.push(reminder_id, next_due_at)
+    else:
+        storage.mark_fired(reminder_id, next_follow_up_at, fired_at)
+    if next_follow_up_at is not None:
+        follow_up_wheel.add(reminder_id, next_follow_up_at)
+
+# Function to handle reminders more than MAX_CATCH_UP seconds overdue, e.g. after
+# long downtime: repeating ones skip ahead to their next occurrence, one-off ones
+# are recorded as missed and the user is told instead of getting the reminder
+async def skip_missed_reminders(missed):
+    now = int(time.time())
+    deferred = []
+    for reminder_id, chat_id, text, due_at, repeat in await storage.run_db(
+            storage.get_missed_batch, [reminder_id for reminder_id, _ in missed]):
+        if not owns_chat(chat_id):
+            if lease_lapsed(chat_id):
+                deferred.append((reminder_id, due_at))
+            continue
+        if repeat:
+            next_due_at = next_occurrence(repeat, due_at, now)
+            future = storage.reschedule_reminder(reminder_id, next_due_at)
+            due_heap.push(reminder_id, next_due_at)
+        else:
+            future = storage.mark_missed(reminder_id)
+            send_queue.send(chat_id, priority=PRIORITY_REMINDER,
+                            text=f"{text}\nMissed reminder ({reminder_id}), due {format_due_at(due_at)}")
+        future.add_done_callback(lambda f, chat_id=chat_id: page_cache.invalidate(chat_id))
+    defer_reminders(deferred)
+    logger.info("Skipped %d reminders more than %ds overdue", len(missed), MAX_CATCH_UP)
+
+# Function to send every follow-up that is due, once per wheel slot
+@metrics.timed(TICK_SECONDS, 'send_follow_ups')
+async def send_follow_ups(context: CallbackContext):
+    now = int(time.time())
+    due_ids = follow_up_wheel.pop_due(now)
+    if not due_ids:
+        return
+
+    # One lookup for the whole slot; acknowledged and deleted reminders drop out here
+    for reminder_id, chat_id, text, follow_ups in await storage.run_db(storage.get_follow_up_batch, due_ids, now):
+        if not owns_chat(chat_id):
+            if lease_lapsed(chat_id):
+                follow_up_wheel.add(reminder_id, now + LEASE_RENEW_INTERVAL)
+            continue
+        # The limit may have been lowered since this follow-up was scheduled
+        if MAX_FOLLOW_UPS is not None and follow_ups >= MAX_FOLLOW_UPS:
+            storage.stop_follow_ups(reminder_id)
+            continue
+        message_text = f"{text}\nReminder ({reminder_id}) Follow-Up"
+        keyboard = [[InlineKeyboardButton("Done", callback_data=encode_callback(CB_DONE, reminder_id))]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
 
-    context.bot.send_message(chat_id=chat_id, text=message_text, reply_markup=reply_markup)
+        send_queue.send(chat_id, priority=PRIORITY_FOLLOW_UP, text=message_text, reply_markup=reply_markup)
 
-# Function to check and send reminders
-def check_reminders(context: CallbackContext):
-    now = datetime.datetime.now()
-    conn = get_db_connection()
-    cursor = conn.execute("SELECT id, chat_id, text, date FROM reminders WHERE datetime(date) <= ?", (now.strftime("%Y-%m-%d %H:%M"),))
+        if MAX_FOLLOW_UPS is not None and follow_ups + 1 >= MAX_FOLLOW_UPS:
+            storage.mark_follow_up(reminder_id, None)
+        else:
+            next_follow_up_at = now + FOLLOW_UP_INTERVAL
+            storage.mark_follow_up(reminder_id, next_follow_up_at)
+            follow_up_wheel.add(reminder_id, next_follow_up_at)
 
-    for row in cursor.fetchall():
-        reminder_id, chat_id, text, date = row
-        job_context = {'chat_id': chat_id, 'reminder_id': reminder_id, 'text': text}
-        context.job_queue.run_once(send_reminder, 0, context=job_context)
+# Function to drop conversations that have been idle for longer than their TTL
+async def evict_conversations(context: CallbackContext):
+    evicted = conversations.evict_expired()
+    if evicted:
+        logger.info("Dropped %d abandoned conversations", evicted)
 
-# Function to handle user input for adding a channel
-def handle_channel_input(update, context):
+async def handle_channel_input(update, context):
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
 
-    # Check if the user is an admin and waiting for a channel link
-    if user_id in ADMIN_CHAT_IDS and context.user_data.get('waiting_for_channel_link', False):
+    # Only reached while waiting for a channel link; check the user is still an admin
+    if user_id in ADMIN_CHAT_IDS:
         channel_link = update.message.text
-        save_channel(chat_id, channel_link)
-        update.message.reply_text(f"Channel link saved successfully: {channel_link}")
+        await storage.run_db(storage.save_channel, chat_id, channel_link)
+        await update.message.reply_text(f"Channel link saved successfully: {channel_link}")
         # Reset the state
-        context.user_data['waiting_for_channel_link'] = False
+        conversations.clear(user_id)
     else:
-        update.message.reply_text("Invalid command or unauthorized.")
-
-def save_channel(chat_id, channel_link):
-    conn = get_channels_db_connection()
-    conn.execute("INSERT INTO channels (chat_id, name) VALUES (?, ?)", (chat_id, channel_link))
-    conn.commit()
+        await update.message.reply_text("Invalid command or unauthorized.")
 
 # Function to handle "/start" command
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 CHANNEL_INFO_FILE = 'channel_info.json'
 
-def start(update, context):
-    with open(CHANNEL_INFO_FILE, 'r') as file:
-        channel_info = json.load(file)
+# Channel list (reloaded when the file changes) and cached membership answers
+channel_list = ChannelList(CHANNEL_INFO_FILE)
+membership_cache = MembershipCache()
 
-    channel_chat_ids = channel_info.get('channel_chat_ids', [])
+async def start(update, context):
+    channel_chat_ids = channel_list.get()
     chat_id = update.message.chat_id
     user_id = update.message.from_user.id
 
     if channel_chat_ids:
-        is_member_of_all_channels = all(
-            context.bot.get_chat_member(channel_chat_id, user_id).status == 'member' for channel_chat_id in
-            channel_chat_ids)
+        is_member_of_all_channels = await is_member_of_all(context.bot, membership_cache, user_id, channel_chat_ids)
         if is_member_of_all_channels or user_id in ADMIN_CHAT_IDS:
             # User is a member of all channels, proceed with the regular functionality
 
             # Create buttons in the welcome message
             keyboard = [
-                [InlineKeyboardButton("Set Reminder", callback_data='press_button')],
-                [InlineKeyboardButton("My Reminders", callback_data='my_reminders')]
+                [InlineKeyboardButton("Set Reminder", callback_data=encode_callback(CB_SET_REMINDER))],
+                [InlineKeyboardButton("My Reminders", callback_data=encode_callback(CB_MY_REMINDERS))]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -207,9 +493,9 @@ def start(update, context):
                 admin_message = "You are an admin. Use /addchannel to add a new channel. " \
                                 "Additionally, you can use /removechannel to remove a channel."
 
-                update.message.reply_text(f'Welcome! Use /setreminder to set a reminder. You can also use /myreminders to see your reminders.\n\n{admin_message}', reply_markup=reply_markup)
+                await update.message.reply_text(f'Welcome! Use /setreminder to set a reminder. You can also use /myreminders to see your reminders.\n\n{admin_message}', reply_markup=reply_markup)
             else:
-                update.message.reply_text('Welcome! Use /setreminder to set a reminder. You can also use /myreminders to see your reminders.', reply_markup=reply_markup)
+                await update.message.reply_text('Welcome! Use /setreminder to set a reminder. You can also use /myreminders to see your reminders.', reply_markup=reply_markup)
         else:
             # User is not a member of all channels, provide buttons to join channel or restart
             join_channel_buttons = [
@@ -217,7 +503,7 @@ def start(update, context):
             ]
             join_channel_markup = InlineKeyboardMarkup([join_channel_buttons])
 
-            update.message.reply_text(
+            await update.message.reply_text(
                 "Welcome!\n\nTo use our bot, join all specified channels first. \n\nClick the button below to join the first channel:",
                 reply_markup=join_channel_markup,
                 parse_mode=ParseMode.MARKDOWN
@@ -231,249 +517,471 @@ def start(update, context):
 ADMIN_CHAT_IDS = [224836224]  # Replace with the actual admin chat IDs
 
 # Function to handle "/deletereminder" command
-def delete_reminder_command(update, context):
+async def delete_reminder_command(update, context):
     chat_id = update.message.chat_id
-    reminders = get_reminders(chat_id)
-
-    if not reminders:
-        update.message.reply_text("You have no reminders to delete.")
-    else:
-        keyboard = []
-        for reminder_id, text, date in reminders:
-            keyboard.append([InlineKeyboardButton(f"Delete {reminder_id}", callback_data=f'delete_{reminder_id}')])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text("Select a reminder to delete:", reply_markup=reply_markup)
+    message_text, reply_markup = await render_reminder_page(chat_id, 'd')
+    await update.message.reply_text(message_text, reply_markup=reply_markup)
 
 # Function to handle delete button presses
-def delete_reminder_button(update, context):
+async def delete_reminder_button(update, context, reminder_id):
     query = update.callback_query
-    query.answer()
+    await query.answer()
 
-    callback_data = query.data
-    print(f"Callback data received: {callback_data}")
-
-    if callback_data.startswith('delete_'):
-        reminder_id_to_delete = int(callback_data.split('_')[1])
-        delete_reminder(reminder_id_to_delete)
-        query.edit_message_text(f'Reminder ({reminder_id_to_delete}) deleted successfully.')
-    else:
-        debug_message = f'Unable to determine reminder ID. Callback data: {query.data}'
-        query.edit_message_text(debug_message)
-        print(debug_message)
-
-        # Print additional context information
-        print(f'Chat ID: {query.message.chat_id}')
-        print(f'Message ID: {query.message.message_id}')
-
-# Function to delete a specific reminder from the database
-def delete_reminder(reminder_id):
-    conn = get_db_connection()
-    conn.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,))
-    conn.commit()
+    reminder_id = int(reminder_id)
+    await delete_reminder(reminder_id, query.message.chat_id)
+    await query.edit_message_text(f'Reminder ({reminder_id}) deleted successfully.')
 
 # Function to handle "/setreminder" command
-def set_reminder(update, context):
-    update.callback_query.edit_message_text('Please enter the text of the reminder:')
-    context.user_data['waiting_for_text'] = True
-
-# Function to handle user input for setting reminders
-def handle_reminder_input(update, context):
-    if 'waiting_for_text' in context.user_data and context.user_data['waiting_for_text']:
-        context.user_data['text'] = update.message.text
-        context.user_data['waiting_for_text'] = False
-
-        # Check if the input is a channel link
-        if update.message.text.startswith('https://t.me/'):
-            # Handle adding the channel link logic here
-            handle_channel_input(update, context)
-        else:
-            update.message.reply_text('Please provide the date and time for the reminder (YYYY-MM-DD HH:MM):')
-    else:
-        try:
-            date_str = update.message.text
-
-            # Check if the input is a channel link
-            if date_str.startswith('https://t.me/'):
-                # Handle adding the channel link logic here
-                handle_channel_input(update, context)
-            else:
-                date = datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M")
-
-                text = context.user_data['text']
-                chat_id = update.message.chat_id
+async def set_reminder(update, context):
+    await update.callback_query.edit_message_text('Please enter the text of the reminder:')
+    conversations.set(update.effective_user.id, STATE_REMINDER_TEXT)
+
+# Function to handle the reminder text
+async def handle_reminder_text(update, context):
+    conversations.set(update.effective_user.id, STATE_REMINDER_DATE, text=update.message.text)
+    await update.message.reply_text('Please provide the date and time for the reminder (YYYY-MM-DD HH:MM), '
+                                    f'optionally followed by {", ".join(REPEAT_RULES)} to repeat it:')
+
+# Function to handle the reminder date; further dates add more reminders with the same text
+async def handle_reminder_date(update, context):
+    # "YYYY-MM-DD HH:MM" with an optional repeat rule after it
+    parts = update.message.text.split()
+    try:
+        date = datetime.datetime.strptime(' '.join(parts[:2]), "%Y-%m-%d %H:%M")
+        repeat = parse_repeat(parts[2]) if len(parts) == 3 else None
+        if len(parts) > 3:
+            raise ValueError(update.message.text)
+    except ValueError:
+        await update.message.reply_text(f'Invalid date format. Please use YYYY-MM-DD HH:MM, '
+                                        f'optionally followed by {", ".join(REPEAT_RULES)}.')
+        return
+
+    user_id = update.effective_user.id
+    text = conversations.get(user_id).text
+    chat_id = update.message.chat_id
 
-                add_reminder(chat_id, text, date)
+    await add_reminder(chat_id, text, date, repeat)
+    # Keep the flow open for more dates with the same text
+    conversations.set(user_id, STATE_REMINDER_DATE, text=text)
 
-                update.message.reply_text('Reminder set successfully!')
+    if repeat:
+        await update.message.reply_text(f'Reminder set successfully! It repeats {repeat}.')
+    else:
+        await update.message.reply_text('Reminder set successfully!')
 
-        except ValueError:
-            update.message.reply_text('Invalid date format. Please use YYYY-MM-DD HH:MM.')
+# Function to handle text that no conversation is waiting for
+async def handle_unexpected_text(update, context):
+    await update.message.reply_text('Use /start to set a reminder.')
 
-def button_handler(update, context):
+# Function to handle the "Done" button
+async def done_button(update, context, reminder_id):
     query = update.callback_query
-    query.answer()
+    await query.answer()
+
+    reminder_id = int(reminder_id)
+    # The database, not the in-memory job table, knows whether the reminder is still pending
+    row = await storage.run_db(storage.get_reminder, reminder_id)
+    if row is not None and row[2]:
+        # Done on a repeating reminder ends this occurrence's follow-ups, not the series
+        future = storage.stop_follow_ups(reminder_id)
+        if DURABLE_WRITES:
+            await storage.wait_for_write(future)
+        await query.edit_message_text(f'Reminder ({reminder_id}) marked as done. It repeats {row[2]}; '
+                                      f'use /deletereminder to stop it.')
+    elif row is not None:
+        await acknowledge_reminder(reminder_id, query.message.chat_id)
+        await query.edit_message_text(f'Reminder ({reminder_id}) marked as done.')
+    else:
+        await query.edit_message_text(f'Reminder ({reminder_id}) is already done or was deleted.')
 
-    callback_data = query.data.split('_')
-    action = callback_data[0]
+# Function to handle buttons whose callback data is not recognised
+async def unknown_button(update, context):
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text('Invalid button callback.')
 
-    if action == 'done' and len(callback_data) == 2:
-        reminder_id = int(callback_data[1])
+# Function to handle the "Set Reminder" button
+async def button_press_handler(update: Update, context):
+    query = update.callback_query
+    await query.answer()
 
-        # Check if there is an associated job for this reminder ID
-        if reminder_id in reminder_jobs:
-            # Delete the reminder from the database
-            delete_reminder(reminder_id)
+    # Execute the logic for /setreminder command
+    await set_reminder(update, context)
 
-            # Cancel the repeating job for this reminder
-            reminder_jobs[reminder_id].schedule_removal()
+# Function to handle "/stats" command
+async def stats_command(update, context):
+    user_id = update.message.from_user.id
 
-            query.edit_message_text(f'Reminder ({reminder_id}) marked as done.')
-        else:
-            query.edit_message_text(f'No associated job found for reminder ID {reminder_id}.')
-    elif action == 'delete' and len(callback_data) == 2:
-        reminder_id = int(callback_data[1])
-        delete_reminder(reminder_id)
-        query.edit_message_text(f'Reminder ({reminder_id}) deleted successfully.')
-    elif callback_data[0] == 'remove' and len(callback_data) == 3:
-        channel_id = int(callback_data[2])
-        remove_channel(channel_id)
-        query.edit_message_text(f'Channel ({channel_id}) removed successfully.')
-    elif action == 'press' and len(callback_data) == 2:
-        button_press_handler(update, context)
-    elif action == 'my' and callback_data[1] == 'reminders':
-        # Call your my_reminders function here
-        my_reminders(update, context)
-    elif action == 'restart':  # Check for the "Restart" button
-        restart_handler(update, context)
+    if user_id in ADMIN_CHAT_IDS:
+        stats = membership_cache.stats()
+        queue_stats = send_queue.stats()
+        page_stats = page_cache.stats()
+        conversation_stats = conversations.stats()
+        # An ingress process does not fire reminders
+        firing = (f"\nFiring: {firing_engine.fired} fired, {firing_engine.caught_up} caught up late, "
+                  f"{firing_engine.missed} missed, {firing_engine.stalls} stalls, {firing_engine.clock_steps} clock steps"
+                  if firing_engine is not None else "")
+        await update.message.reply_text(
+            f"Membership cache: {stats['entries']} entries, {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['evictions']} evictions\n"
+            f"Send queue: {queue_stats['depth']} queued (max {queue_stats['max_depth']}), "
+            f"{queue_stats['sent']} sent, {queue_stats['failed']} failed, {queue_stats['rate_limited']} rate limited\n"
+            f"Listing pages: {page_stats['chats']} chats cached, {page_stats['hit_rate']:.0%} hit rate, "
+            f"{page_stats['invalidations']} invalidations\n"
+            f"Conversations: {conversation_stats['active']} active, {conversation_stats['expired']} expired, "
+            f"{conversation_stats['bytes_per_conversation']:.0f} bytes each\n"
+            f"Scheduled reminders: {len(due_heap)}, pending follow-ups: {len(follow_up_wheel)}{firing}")
     else:
-        query.edit_message_text('Invalid button callback.')
-
-def button_click_handler(update, context):
-    query = update.callback_query
-    query.answer()
-
-    callback_data = query.data
+        await update.message.reply_text("You are not authorized to use this command.")
+
+# Function to run a bulk import or export on the SQLite executor, editing `status` with its progress
+async def run_bulk_job(status, verb, job, *args):
+    done = [0]
+
+    def progress(count):
+        done[0] = count
+
+    task = asyncio.ensure_future(storage.run_db(storage.with_reminders_connection, job, *args, progress))
+    shown = 0
+    while True:
+        finished, _ = await asyncio.wait([task], timeout=BULK_PROGRESS_INTERVAL)
+        if finished:
+            return task.result()
+        if done[0] != shown:
+            shown = done[0]
+            await status.edit_text(f"{verb} {shown} reminders...")
+
+# Function to handle "/importreminders" command
+async def import_reminders_command(update, context):
+    user_id = update.message.from_user.id
 
-    if callback_data == 'my_reminders':
-        my_reminders(update, context)
+    if user_id in ADMIN_CHAT_IDS:
+        await update.message.reply_text("Send a .csv or .jsonl file of reminders. CSV needs a chat_id,text,due_at "
+                                        "header and an optional repeat column; due_at is epoch seconds or a local "
+                                        "YYYY-MM-DD HH:MM time.")
+        conversations.set(user_id, STATE_IMPORT_FILE)
     else:
-        query.edit_message_text('kobs')
-    
-# Add a new function to handle the button press
-def button_press_handler(update: Update, context):
-    query = update.callback_query
-    query.answer()
+        await update.message.reply_text("You are not authorized to use this command.")
 
-    # Execute the logic for /setreminder command
-    set_reminder(update, context)
+# Function to import the file an admin sent after /importreminders
+async def handle_import_document(update, context):
+    user_id = update.message.from_user.id
+    if conversations.state(user_id) != STATE_IMPORT_FILE:
+        return
+
+    document = update.message.document
+    try:
+        fmt = bulk.detect_format(document.file_name or '')
+    except ValueError:
+        await update.message.reply_text("Please send a .csv or .jsonl file.")
+        return
+    conversations.clear(user_id)
+
+    status = await update.message.reply_text("Downloading...")
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(document.file_name)[1])
+    os.close(fd)
+    try:
+        file = await document.get_file()
+        await file.download_to_drive(path)
+        max_id = await storage.run_db(storage.get_max_reminder_id)
+        imported, skipped = await run_bulk_job(status, "Imported", bulk.import_file, path, fmt)
+    except Exception as e:
+        logger.exception("Import of %s failed", document.file_name)
+        await status.edit_text(f"Import failed: {e}")
+        return
+    finally:
+        os.remove(path)
+
+    # Schedule the new reminders and drop listings that no longer include them
+    if ROLE == 'all':
+        schedule_reminders(await storage.run_db(storage.get_due_index_after, max_id))
+    page_cache.clear()
+    await status.edit_text(f"Imported {imported} reminders, skipped {skipped} bad rows.")
+
+# Function to handle "/exportreminders [csv|jsonl]" command
+async def export_reminders_command(update, context):
+    user_id = update.message.from_user.id
 
-    # Use context.bot.send_message to send a message
-    context.user_data['waiting_for_text'] = True
-    query.edit_message_text('Please enter the text of the reminder:')
+    if user_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("You are not authorized to use this command.")
+        return
+
+    fmt = context.args[0].lower() if context.args else 'csv'
+    if fmt not in ('csv', 'jsonl'):
+        await update.message.reply_text("Usage: /exportreminders [csv|jsonl]")
+        return
+
+    status = await update.message.reply_text("Exporting...")
+    fd, path = tempfile.mkstemp(suffix='.' + fmt)
+    os.close(fd)
+    try:
+        exported = await run_bulk_job(status, "Exported", bulk.export_file, path, fmt)
+        with open(path, 'rb') as file:
+            await update.message.reply_document(file, filename=f'reminders.{fmt}')
+        await status.edit_text(f"Exported {exported} reminders.")
+    except Exception as e:
+        logger.exception("Export failed")
+        await status.edit_text(f"Export failed: {e}")
+    finally:
+        os.remove(path)
 
 # Function to delete a reminder from the database
-def delete_reminder(reminder_id):
-    conn = get_db_connection()
-    conn.execute("DELETE FROM reminders WHERE id = ?", (reminder_id,))
-    conn.commit()
-
-def remove_channel_command(update, context):
+async def delete_reminder(reminder_id, chat_id):
+    due_heap.discard(reminder_id)
+    future = storage.delete_reminder(reminder_id)
+    future.add_done_callback(lambda f: page_cache.invalidate(chat_id))
+    if DURABLE_WRITES:
+        await storage.wait_for_write(future)
+
+# Function to mark a reminder as done and stop its follow-ups
+async def acknowledge_reminder(reminder_id, chat_id):
+    due_heap.discard(reminder_id)
+    future = storage.acknowledge_reminder(reminder_id)
+    future.add_done_callback(lambda f: page_cache.invalidate(chat_id))
+    if DURABLE_WRITES:
+        await storage.wait_for_write(future)
+
+async def remove_channel_command(update, context):
     chat_id = update.message.chat_id
 
     # Check if the user is an admin
     if chat_id in ADMIN_CHAT_IDS:
-        channels = get_channels()
+        channels = await storage.run_db(storage.get_channels)
 
         if not channels:
-            update.message.reply_text("No channels to remove.")
+            await update.message.reply_text("No channels to remove.")
         else:
             keyboard = []
             for channel_id, channel_link in channels:
-                keyboard.append([InlineKeyboardButton(f"Remove {channel_link}", callback_data=f'remove_channel_{channel_id}')])
+                keyboard.append([InlineKeyboardButton(f"Remove {channel_link}", callback_data=encode_callback(CB_REMOVE_CHANNEL, channel_id))])
 
             reply_markup = InlineKeyboardMarkup(keyboard)
-            update.message.reply_text("Select a channel to remove:", reply_markup=reply_markup)
+            await update.message.reply_text("Select a channel to remove:", reply_markup=reply_markup)
     else:
-        update.message.reply_text("You are not authorized to remove channels.")
+        await update.message.reply_text("You are not authorized to remove channels.")
 
 # Function to handle remove channel button presses
-def remove_channel_button(update, context):
+async def remove_channel_button(update, context, channel_id):
     query = update.callback_query
-    query.answer()
+    await query.answer()
 
-    callback_data = query.data
-    print(f"Callback data received: {callback_data}")
+    channel_id = int(channel_id)
+    await storage.run_db(storage.remove_channel, channel_id)
+    await query.edit_message_text(f'Channel ({channel_id}) removed successfully.')
 
-    if callback_data.startswith('remove_channel_'):
-        channel_id_to_remove = int(callback_data.split('_')[2])
-        remove_channel(channel_id_to_remove)
-        query.edit_message_text(f'Channel ({channel_id_to_remove}) removed successfully.')
-    else:
-        debug_message = f'Unable to determine channel ID. Callback data: {query.data}'
-        query.edit_message_text(debug_message)
-        print(debug_message)
-
-        # Print additional context information
-        print(f'Chat ID: {query.message.chat_id}')
-        print(f'Message ID: {query.message.message_id}')
-
-# Function to remove a specific channel from the database
-def remove_channel(channel_id):
-    conn = get_channels_db_connection()
-    conn.execute("DELETE FROM channels WHERE id = ?", (channel_id,))
-    conn.commit()
-
-# Function to get channels from the database
-def get_channels():
-    conn = get_channels_db_connection()
-    cursor = conn.execute("SELECT id, name FROM channels")  # Use 'name' as the column name
-    return cursor.fetchall()
-
-def restart(update: Update, context: CallbackContext):
+async def restart(update: Update, context: CallbackContext):
     # Handle the restart logic here
-    start(update, context)
+    await start(update, context)
 
-def restart_handler(update, context):
+async def restart_handler(update, context):
     query = update.callback_query
-    query.answer()
+    await query.answer()
 
     # Call the start function to simulate a restart
-    start(update, context)
+    await start(update, context)
 
     # Optionally, you can send a message indicating the restart
-    context.bot.send_message(chat_id=query.message.chat_id, text="Restarting...")
-
-if __name__ == '__main__':
-    updater = Updater("TOKEN", use_context=True)
-        
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
+    await context.bot.send_message(chat_id=query.message.chat_id, text="Restarting...")
+
+# Function to set up storage, scheduler state and jobs once the event loop is running
+async def on_startup(application):
+    global send_queue, metrics_server, leases, last_reminder_id, firing_engine
+
+    # Open the connection pools and set up the schema once, before any handler runs
+    storage.init_storage()
+
+    # Rebuild scheduler state once: unfired reminders go to the due-time index,
+    # fired but unacknowledged ones get their follow-ups back. Workers load only
+    # the shards they win a lease on, in renew_leases.
+    if ROLE == 'all':
+        load_due_heap()
+        restore_follow_ups()
+    if PERSIST_CONVERSATIONS and ROLE != 'worker':
+        conversations.load()
+    if ROLE == 'ingress':
+        page_cache.ttl = INGRESS_PAGE_CACHE_TTL
+
+    # Start the outbound send queue used by the reminder jobs. Workers share
+    # Telegram's global limit, so each one gets its part of it.
+    global_rate = GLOBAL_RATE / WORKER_COUNT if ROLE == 'worker' else GLOBAL_RATE
+    send_queue = SendQueue(application.bot, global_rate=global_rate)
+    send_queue.start()
+
+    if ROLE != 'ingress':
+        firing_engine = FiringEngine(due_heap, fire_reminders, skip_missed_reminders)
+
+    if ROLE == 'worker':
+        leases = LeaseManager(WORKER_INDEX, WORKER_COUNT)
+        last_reminder_id = await storage.run_db(storage.get_max_reminder_id)
+        # Take our shards before firing starts, then keep the leases renewed
+        await renew_leases(application)
+        application.job_queue.run_repeating(renew_leases, interval=LEASE_RENEW_INTERVAL)
+        application.job_queue.run_repeating(load_new_reminders, interval=NEW_REMINDER_POLL_INTERVAL)
+
+    if ROLE != 'ingress':
+        # Reminders fire at their due time; those that fell due while the bot was down are caught up first
+        firing_engine.start()
+
+        # One job drives all follow-ups, ticking at the start of every wheel slot
+        application.job_queue.run_repeating(send_follow_ups, interval=FOLLOW_UP_SLOT,
+                                            first=FOLLOW_UP_SLOT - time.time() % FOLLOW_UP_SLOT)
+
+    if ROLE != 'worker':
+        # Drop flows users abandoned halfway
+        application.job_queue.run_repeating(evict_conversations, interval=CONVERSATION_SWEEP_INTERVAL)
+
+    if METRICS_ENABLED:
+        metrics_server = await metrics.MetricsServer().start(METRICS_HOST, METRICS_PORT)
+
+# Function to deliver queued messages while the bot can still send them
+async def on_stop(application):
+    if firing_engine is not None:
+        await firing_engine.stop()
+    await send_queue.stop()
+    # Hand the shards over now instead of after the leases expire
+    if leases is not None:
+        await storage.run_db(leases.release_all)
+
+# Function to flush queued writes before exiting
+async def on_shutdown(application):
+    storage.close_storage()
+    if metrics_server is not None:
+        await metrics_server.stop()
+
+# Bot API requests, timed per method
+class TimedRequest(HTTPXRequest):
+    async def do_request(self, url, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            # File downloads have the file path in the URL; keep them under one label
+            api_method = 'download' if '/file/bot' in url else url.rsplit('/', 1)[-1]
+            API_SECONDS.labels(api_method).observe(time.perf_counter() - start)
+
+# Function to wrap a handler callback so its run time is recorded under `name`
+def timed_handler(name, callback):
+    return metrics.timed(HANDLER_SECONDS, name)(callback)
+
+# Function to build the routing table for buttons and text input
+def build_router():
+    router = Router(conversations.state)
+    router.on_callback(CB_DONE, timed_handler('done_button', done_button))
+    router.on_callback(CB_DELETE, timed_handler('delete_reminder_button', delete_reminder_button))
+    router.on_callback(CB_PAGE, timed_handler('page_button', page_button))
+    router.on_callback(CB_REMOVE_CHANNEL, timed_handler('remove_channel_button', remove_channel_button))
+    router.on_callback(CB_SET_REMINDER, timed_handler('button_press_handler', button_press_handler))
+    router.on_callback(CB_MY_REMINDERS, timed_handler('my_reminders_button', my_reminders_button))
+    router.on_callback(CB_RESTART, timed_handler('restart_handler', restart_handler))
+    router.fallback_callback(timed_handler('unknown_button', unknown_button))
+
+    # Buttons already sent with the old "done_12" style callback data keep working
+    router.on_legacy_callback('done', CB_DONE)
+    router.on_legacy_callback('delete', CB_DELETE)
+    router.on_legacy_callback('page', CB_PAGE)
+    router.on_legacy_callback('remove', CB_REMOVE_CHANNEL, skip=2)
+    router.on_legacy_callback('press', CB_SET_REMINDER, skip=2)
+    router.on_legacy_callback('my', CB_MY_REMINDERS, skip=2)
+    router.on_legacy_callback('restart', CB_RESTART)
+
+    router.on_text(STATE_CHANNEL_LINK, timed_handler('handle_channel_input', handle_channel_input))
+    router.on_text(STATE_REMINDER_TEXT, timed_handler('handle_reminder_text', handle_reminder_text))
+    router.on_text(STATE_REMINDER_DATE, timed_handler('handle_reminder_date', handle_reminder_date))
+    router.fallback_text(timed_handler('handle_unexpected_text', handle_unexpected_text))
+    return router
+
+# Function to build the application with every handler registered
+def build_application(token, base_url=None):
+    # Same pool sizes as PTB's defaults, with every request timed
+    builder = (Application.builder().token(token).concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+               .request(TimedRequest(connection_pool_size=256)).get_updates_request(TimedRequest())
+               .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown))
+    if base_url is not None:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    router = build_router()
+
+    # Buttons and free text each go through one handler that looks up the target in a dict
+    application.add_handler(CallbackQueryHandler(router.dispatch_callback))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, router.dispatch_text))
+    application.add_handler(MessageHandler(filters.Document.ALL, timed_handler('handle_import_document', handle_import_document)))
 
     # Register command handlers
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("restart", restart))
-    dp.add_handler(CommandHandler("setreminder", set_reminder))
-    dp.add_handler(CommandHandler("help", start))
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_reminder_input))
-    dp.add_handler(CallbackQueryHandler(button_handler))
-    dp.add_handler(CommandHandler("myreminders", my_reminders))
-    dp.add_handler(CommandHandler("deletereminder", delete_reminder_command))
-    dp.add_handler(CallbackQueryHandler(delete_reminder_button))
-    dp.add_handler(CommandHandler("addchannel", add_channel))
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_channel_input))
-    dp.add_handler(CommandHandler("removechannel", remove_channel_command))
-    dp.add_handler(CallbackQueryHandler(remove_channel_button))
-    dp.add_handler(CallbackQueryHandler(button_press_handler))
-    dp.add_handler(CallbackQueryHandler(button_click_handler))
-
-    # Schedule the check_and_schedule_reminders function to run every 2 seconds
-    updater.job_queue.run_repeating(check_and_schedule_reminders, interval=2, first=0)
-
-
-
-    # Start the Bot
-    updater.start_polling()
-
-    # Keep the bot running
-    updater.idle()
\ No newline at end of file
+    application.add_handler(CommandHandler("start", timed_handler('/start', start)))
+    application.add_handler(CommandHandler("restart", timed_handler('/restart', restart)))
+    application.add_handler(CommandHandler("setreminder", timed_handler('/setreminder', set_reminder)))
+    application.add_handler(CommandHandler("help", timed_handler('/help', start)))
+    application.add_handler(CommandHandler("myreminders", timed_handler('/myreminders', my_reminders)))
+    application.add_handler(CommandHandler("deletereminder", timed_handler('/deletereminder', delete_reminder_command)))
+    application.add_handler(CommandHandler("addchannel", timed_handler('/addchannel', add_channel)))
+    application.add_handler(CommandHandler("removechannel", timed_handler('/removechannel', remove_channel_command)))
+    application.add_handler(CommandHandler("stats", timed_handler('/stats', stats_command)))
+    application.add_handler(CommandHandler("importreminders", timed_handler('/importreminders', import_reminders_command)))
+    application.add_handler(CommandHandler("exportreminders", timed_handler('/exportreminders', export_reminders_command)))
+
+    return application
+
+# Function to start the webhook server and point Telegram at it
+async def start_webhook(application):
+    global webhook_server
+    webhook_server = await WebhookServer(application, secret_token=WEBHOOK_SECRET,
+                                         workers=WEBHOOK_WORKERS).start(WEBHOOK_HOST, WEBHOOK_PORT)
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+
+# Function to run the bot until SIGINT or SIGTERM without polling: a worker
+# process (job queue and sender only), or the bot fed by the webhook server
+async def run_without_polling(application):
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    if WEBHOOK_ENABLED and ROLE != 'worker':
+        await start_webhook(application)
+    await stop.wait()
+    # Finish the updates already accepted while the job queue still runs
+    if webhook_server is not None:
+        await webhook_server.stop()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reminder bot")
+    parser.add_argument('--role', choices=['all', 'ingress', 'worker'], default=ROLE,
+                        help="'all' (default) runs everything in one process; run one 'ingress' and "
+                             "--workers 'worker' processes to spread the scheduler over several cores")
+    parser.add_argument('--worker', type=int, default=WORKER_INDEX, help="index of this worker, from 0")
+    parser.add_argument('--workers', type=int, default=WORKER_COUNT, help="number of worker processes")
+    parser.add_argument('--token', default="TOKEN")
+    parser.add_argument('--base-url', help="Bot API base URL, e.g. a local test server")
+    parser.add_argument('--metrics-port', type=int,
+                        help=f"default {METRICS_PORT}, or {METRICS_PORT} + 1 + the index for workers")
+    parser.add_argument('--webhook', action='store_true', help="receive updates on a webhook instead of polling")
+    parser.add_argument('--webhook-url', help="public HTTPS URL to register with Telegram, ending in "
+                                              f"{webhook.WEBHOOK_PATH}")
+    parser.add_argument('--webhook-host', default=WEBHOOK_HOST)
+    parser.add_argument('--webhook-port', type=int, default=WEBHOOK_PORT)
+    parser.add_argument('--webhook-workers', type=int, default=WEBHOOK_WORKERS,
+                        help="updates handled at once; one chat's updates always run in order")
+    args = parser.parse_args()
+    ROLE, WORKER_INDEX, WORKER_COUNT = args.role, args.worker, args.workers
+    WEBHOOK_ENABLED = args.webhook or args.webhook_url is not None
+    WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT = args.webhook_url, args.webhook_host, args.webhook_port
+    WEBHOOK_WORKERS = args.webhook_workers
+    if args.metrics_port is not None:
+        METRICS_PORT = args.metrics_port
+    elif ROLE == 'worker':
+        METRICS_PORT += 1 + WORKER_INDEX
+
+    application = build_application(args.token, args.base_url)
+
+    if ROLE == 'worker' or WEBHOOK_ENABLED:
+        asyncio.run(run_without_polling(application))
+    else:
+        # Start the Bot and keep it running until interrupted
+        application.run_polling()
\ No newline at end of file
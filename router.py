@@ -0,0 +1,72 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Callback data is "<version>:<code>:<arg>:<arg>...", e.g. "1:d:42" for Done on
+# reminder 42. Bump the version when the meaning of a code or its arguments changes.
+CALLBACK_VERSION = '1'
+CALLBACK_SEPARATOR = ':'
+_CALLBACK_PREFIX = CALLBACK_VERSION + CALLBACK_SEPARATOR
+
+
+# Function to encode a button's callback data; Telegram allows at most 64 bytes
+def encode_callback(code, *args):
+    data = CALLBACK_SEPARATOR.join((CALLBACK_VERSION, code) + tuple(str(arg) for arg in args))
+    if len(data.encode()) > 64:
+        raise ValueError(f"Callback data too long: {data!r}")
+    return data
+
+
+# Dispatches callback queries by code and text messages by the user's
+# conversation state, each with one dict lookup instead of a handler chain.
+# `state_of(user_id)` returns the user's current conversation state or None.
+class Router:
+    def __init__(self, state_of):
+        self.state_of = state_of
+        self._callbacks = {}
+        # Buttons sent before versioned callback data: first '_' field -> (code, fields to skip)
+        self._legacy = {}
+        self._states = {}
+        self._fallback_callback = None
+        self._fallback_text = None
+
+    # Handlers are called as handler(update, context, *args)
+    def on_callback(self, code, handler):
+        self._callbacks[code] = handler
+
+    def on_legacy_callback(self, prefix, code, skip=1):
+        self._legacy[prefix] = (code, skip)
+
+    # Handlers are called as handler(update, context)
+    def on_text(self, state, handler):
+        self._states[state] = handler
+
+    def fallback_callback(self, handler):
+        self._fallback_callback = handler
+
+    def fallback_text(self, handler):
+        self._fallback_text = handler
+
+    # Function to turn callback data into (code, args); (None, ()) if unknown
+    def decode_callback(self, data):
+        if data.startswith(_CALLBACK_PREFIX):
+            parts = data.split(CALLBACK_SEPARATOR)
+            return parts[1], parts[2:]
+        parts = data.split('_')
+        legacy = self._legacy.get(parts[0])
+        if legacy is None:
+            return None, ()
+        code, skip = legacy
+        return code, parts[skip:]
+
+    async def dispatch_callback(self, update, context):
+        code, args = self.decode_callback(update.callback_query.data or '')
+        handler = self._callbacks.get(code)
+        if handler is None:
+            logger.warning("Unknown callback data %r", update.callback_query.data)
+            return await self._fallback_callback(update, context)
+        return await handler(update, context, *args)
+
+    async def dispatch_text(self, update, context):
+        handler = self._states.get(self.state_of(update.effective_user.id), self._fallback_text)
+        return await handler(update, context)
@@ -0,0 +1,187 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Longest the firing loop sleeps at once. It reads the wall clock again on
+# every wake-up, so a clock step delays no reminder by more than this.
+MAX_SLEEP = 1.0
+# Reminders found overdue (after a stall, a restart or a shard takeover) are
+# still fired if they are at most this late; older ones count as missed
+MAX_CATCH_UP = 3600  # 1 hour in seconds
+# A wake-up this much later than planned counts as a stall of the event loop
+STALL_THRESHOLD = 1.0
+# A jump of this much between the wall clock and the monotonic clock counts as a clock step
+CLOCK_STEP_THRESHOLD = 1.0
+# Seconds the firing loop waits after fire/miss failed before trying those reminders again
+RETRY_DELAY = 1.0
+
+WAKEUP_DRIFT_SECONDS = metrics.registry.histogram('bot_firing_wakeup_drift_seconds',
+                                                  "How much later than planned the firing loop woke up",
+                                                  buckets=metrics.LAG_BUCKETS)
+
+
+# In-memory index of reminder due times, ordered by due time.
+# It is loaded once at startup and kept up to date by add_reminder/delete_reminder,
+# so a scheduler tick only touches the reminders that are actually due.
+class DueHeap:
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._lock = threading.Lock()
+
+    # Replace the heap contents with (reminder_id, due_timestamp) rows
+    def load(self, rows):
+        with self._lock:
+            self._due = {reminder_id: due for reminder_id, due in rows}
+            self._heap = [(due, reminder_id) for reminder_id, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+    # Add many (reminder_id, due_timestamp) rows at once, e.g. after a bulk import
+    def extend(self, rows):
+        with self._lock:
+            for reminder_id, due in rows:
+                self._due[reminder_id] = due
+                self._heap.append((due, reminder_id))
+            heapq.heapify(self._heap)
+
+    # Add or reschedule a reminder
+    def push(self, reminder_id, due):
+        with self._lock:
+            self._due[reminder_id] = due
+            heapq.heappush(self._heap, (due, reminder_id))
+
+    # Forget a reminder; its stale heap entry is skipped when it reaches the top
+    def discard(self, reminder_id):
+        with self._lock:
+            self._due.pop(reminder_id, None)
+
+    # Pop and return the ids of every reminder due at or before the given timestamp
+    def pop_due(self, until):
+        due_ids = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= until:
+                due, reminder_id = heapq.heappop(heap)
+                # Skip entries that were deleted or rescheduled after being pushed
+                if self._due.get(reminder_id) != due:
+                    continue
+                del self._due[reminder_id]
+                due_ids.append((reminder_id, due))
+            # Drop stale entries at the top so they don't pile up
+            while heap and self._due.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+        return due_ids
+
+    # Due timestamp of the earliest pending reminder, or None
+    def peek(self):
+        with self._lock:
+            heap = self._heap
+            while heap and self._due.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, reminder_id):
+        return reminder_id in self._due
+
+
+# Fires reminders from a DueHeap at their due time. One task sleeps on the
+# event loop's monotonic timer until the earliest due time, at most MAX_SLEEP,
+# then passes everything due to `fire(rows)` as (reminder_id, due) rows, oldest
+# first. Rows more than MAX_CATCH_UP seconds overdue go to `miss(rows)` instead.
+# Due times stay wall-clock epochs, so the wall clock is read after every sleep
+# and steps of it are counted rather than trusted to the timer.
+class FiringEngine:
+    def __init__(self, heap, fire, miss, clock=time.time, max_sleep=MAX_SLEEP, max_catch_up=MAX_CATCH_UP):
+        self.heap = heap
+        self.fire = fire
+        self.miss = miss
+        self.clock = clock
+        self.max_sleep = max_sleep
+        self.max_catch_up = max_catch_up
+        self.fired = 0
+        self.caught_up = 0
+        self.missed = 0
+        self.stalls = 0
+        self.clock_steps = 0
+        self._loop = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        # Wall-clock time the loop sleeps until; infinite while it is awake
+        self._sleep_until = float('inf')
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run(), name='firing-engine')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # Function to tell the loop a reminder due at `due` was added; safe from any thread
+    def wake(self, due):
+        if self._loop is not None and due < self._sleep_until:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        loop = self._loop
+        offset = self.clock() - loop.time()
+        while True:
+            self._sleep_until = float('inf')
+            self._wakeup.clear()
+            now = self.clock()
+            # A step of the wall clock shows up as a change in its distance from the monotonic clock
+            step = now - loop.time() - offset
+            if abs(step) > CLOCK_STEP_THRESHOLD:
+                self.clock_steps += 1
+                logger.warning("Wall clock stepped by %+.1fs", step)
+            offset += step
+
+            due = self.heap.pop_due(now)
+            if due:
+                missed = [row for row in due if now - row[1] > self.max_catch_up]
+                if missed:
+                    due = [row for row in due if now - row[1] <= self.max_catch_up]
+                    if await self._call(self.miss, missed):
+                        self.missed += len(missed)
+                if await self._call(self.fire, due):
+                    self.fired += len(due)
+                    self.caught_up += sum(1 for _, due_at in due if now - due_at > STALL_THRESHOLD)
+                continue
+
+            next_due = self.heap.peek()
+            delay = self.max_sleep if next_due is None else min(self.max_sleep, max(0.0, next_due - now))
+            self._sleep_until = now + delay
+            planned = loop.time() + delay
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                drift = loop.time() - planned
+                WAKEUP_DRIFT_SECONDS.observe(max(0.0, drift))
+                if drift > STALL_THRESHOLD:
+                    self.stalls += 1
+                    logger.warning("Firing loop woke up %.1fs late, catching up", drift)
+
+    # Rows are already off the heap; if the callback fails they go back on it
+    # with their due times and are tried again after RETRY_DELAY. Returns
+    # whether the callback succeeded.
+    async def _call(self, callback, rows):
+        if not rows:
+            return True
+        try:
+            await callback(rows)
+        except Exception:
+            logger.exception("Firing %d reminders failed, retrying in %.0fs", len(rows), RETRY_DELAY)
+            self.heap.extend(rows)
+            await asyncio.sleep(RETRY_DELAY)
+            return False
+        return True
@@ -0,0 +1,236 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows roughly 30 messages per second overall and 1 per second per chat.
+# Bursts are kept at 1 so no one-second window ever goes over the limit.
+GLOBAL_RATE = 30
+GLOBAL_BURST = 1
+CHAT_RATE = 1
+CHAT_BURST = 1
+
+# Lower numbers are sent first
+PRIORITY_REMINDER = 0
+PRIORITY_FOLLOW_UP = 1
+
+# How many times a message is re-queued after a 429 before giving up
+MAX_RATE_LIMIT_RETRIES = 5
+
+# Sends awaiting a Bot API response at the same time
+MAX_IN_FLIGHT = 32
+
+SEND_WAIT_SECONDS = metrics.registry.histogram('bot_send_queue_wait_seconds', "Time a message waits in the send queue",
+                                               buckets=metrics.LAG_BUCKETS)
+
+
+# Token bucket refilled continuously at `rate` tokens per second
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until a token is available (0 if one is available now)
+    def delay(self, now):
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Message:
+    __slots__ = ('chat_id', 'kwargs', 'future', 'retries', 'queued_at')
+
+    def __init__(self, chat_id, kwargs, future, now):
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+        self.retries = 0
+        self.queued_at = now
+
+
+# Function to read the back-off from a RetryAfter error (seconds or a timedelta)
+def _retry_after(error):
+    retry_after = getattr(error, 'retry_after', None)
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return retry_after
+
+
+# Outbound dispatcher: job callbacks enqueue messages, one task paces them out while
+# respecting the global and per-chat limits, highest priority first
+class SendQueue:
+    def __init__(self, bot, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_in_flight=MAX_IN_FLIGHT,
+                 clock=time.monotonic):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.clock = clock
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.max_depth = 0
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._chats = {}
+        # (priority, seq, message) ready to go once the buckets allow it
+        self._ready = []
+        # (ready_at, priority, seq, message) waiting on their chat's bucket
+        self._delayed = []
+        self._seq = itertools.count()
+        self._paused_until = 0
+        self._in_flight = 0
+        self._last_prune = clock()
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        self._sends = set()
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run(), name='send-queue')
+
+    # Send everything still queued, then stop the dispatcher task
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    # Queue a send_message call; returns a Future for the sent Message.
+    # Must be called from the event loop thread.
+    def send(self, chat_id, priority=PRIORITY_REMINDER, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        # Most callers never look at the result; don't log unretrieved send errors twice
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        message = _Message(chat_id, dict(kwargs, chat_id=chat_id), future, self.clock())
+        heapq.heappush(self._ready, (priority, next(self._seq), message))
+        self.max_depth = max(self.max_depth, self.depth())
+        self._wakeup.set()
+        return future
+
+    # Number of messages queued or being sent
+    def depth(self):
+        return len(self._ready) + len(self._delayed) + self._in_flight
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'sent': self.sent,
+            'failed': self.failed,
+            'rate_limited': self.rate_limited,
+            'chats': len(self._chats),
+        }
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    # Drop per-chat buckets that have refilled completely; they carry no state
+    def _prune_buckets(self, now):
+        idle = [chat_id for chat_id, bucket in self._chats.items() if bucket.is_full(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    # Wait until a message may be sent, and reserve its tokens
+    async def _next_message(self):
+        while True:
+            now = self.clock()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, priority, seq, message = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (priority, seq, message))
+
+            if now - self._last_prune > 60:
+                self._prune_buckets(now)
+                self._last_prune = now
+
+            wait = None
+            if self._paused_until > now:
+                wait = self._paused_until - now
+            elif self._ready:
+                priority, seq, message = self._ready[0]
+                bucket = self._chat_bucket(message.chat_id, now)
+                chat_delay = bucket.delay(now)
+                if chat_delay > 0:
+                    # Park it so other chats are not held up behind this one
+                    heapq.heappop(self._ready)
+                    heapq.heappush(self._delayed, (now + chat_delay, priority, seq, message))
+                    continue
+                wait = self._global.delay(now)
+                if wait <= 0:
+                    heapq.heappop(self._ready)
+                    bucket.take(now)
+                    self._global.take(now)
+                    self._in_flight += 1
+                    return priority, seq, message
+            elif self._delayed:
+                wait = self._delayed[0][0] - now
+            elif self._stopping and not self._in_flight:
+                return None
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self):
+        while True:
+            item = await self._next_message()
+            if item is None:
+                return
+            # Several sends may await the Bot API at once; pacing already happened above
+            await self._slots.acquire()
+            task = asyncio.get_running_loop().create_task(self._deliver(*item))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _deliver(self, priority, seq, message):
+        SEND_WAIT_SECONDS.observe(self.clock() - message.queued_at)
+        try:
+            result = await self.bot.send_message(**message.kwargs)
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None and message.retries < MAX_RATE_LIMIT_RETRIES:
+                # Telegram asked us to back off: pause everything and retry this one first
+                message.retries += 1
+                self.rate_limited += 1
+                self._paused_until = max(self._paused_until, self.clock() + float(retry_after))
+                heapq.heappush(self._ready, (priority, seq, message))
+                logger.warning("Rate limited by Telegram, pausing sends for %ss", retry_after)
+            else:
+                self.failed += 1
+                logger.error("Failed to send message to chat %s: %s", message.chat_id, e)
+                if not message.future.done():
+                    message.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not message.future.done():
+                message.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            self._wakeup.set()
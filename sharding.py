@@ -0,0 +1,98 @@
+import logging
+import os
+import socket
+import time
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Reminders are split into this many shards by chat id. Changing it moves
+# chats between shards, so only change it with every worker stopped.
+SHARD_COUNT = 16
+# A worker owns a shard until its lease expires; it renews well before that.
+# A crashed worker's shards are taken over LEASE_TTL seconds after its last renewal.
+LEASE_TTL = 15
+LEASE_RENEW_INTERVAL = 5
+# A lease is treated as lost this long before it actually expires, so two
+# workers never send for the same shard at once
+LEASE_MARGIN = 2
+
+
+# Function to map a chat to its shard; matches storage.SQL_SHARD_OF
+def shard_of(chat_id, shards=SHARD_COUNT):
+    return chat_id % shards
+
+
+# Leases held by one worker process. Worker i prefers the shards with
+# shard % workers == i. A shard whose preferred worker is not alive goes to
+# one of the live workers, spread evenly, and comes back once its preferred
+# worker is alive again. All lease state lives in the reminders database, so
+# the workers only need to share that file.
+class LeaseManager:
+    def __init__(self, worker, workers, shards=SHARD_COUNT, ttl=LEASE_TTL, clock=time.time):
+        self.worker = worker
+        self.workers = workers
+        self.shards = shards
+        self.ttl = ttl
+        self.clock = clock
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{worker}"
+        self.started_at = clock()
+        # shard -> expiry of our lease on it
+        self._owned = {}
+
+    def owns(self, chat_id):
+        expires_at = self._owned.get(shard_of(chat_id, self.shards))
+        return expires_at is not None and self.clock() < expires_at - LEASE_MARGIN
+
+    # Whether our lease on the chat's shard lapsed (e.g. the renewal ran late)
+    # without being renewed or handed back; the next lease round decides who has it
+    def lapsed(self, chat_id):
+        return shard_of(chat_id, self.shards) in self._owned and not self.owns(chat_id)
+
+    def owned(self):
+        return sorted(self._owned)
+
+    # The worker that should hold a shard, given which workers are alive
+    def _target(self, shard, alive):
+        preferred = shard % self.workers
+        if preferred in alive or not alive:
+            return preferred
+        alive = sorted(alive)
+        return alive[shard % len(alive)]
+
+    # Function to run one lease round: heartbeat, renew, claim and hand back.
+    # Returns (gained, lost) shard sets. Blocking; run it on the SQLite executor.
+    def renew(self):
+        now = self.clock()
+        expires_at = now + self.ttl
+        leases, alive = storage.lease_round(self.worker, self.owner, self.shards, now, self.ttl)
+        alive.add(self.worker)
+        # Until we have been up for a full TTL, other workers may not have sent
+        # their first heartbeat yet; only take our own shards until then
+        settled = now - self.started_at >= self.ttl
+
+        claim, release = [], []
+        for shard, owner, lease_expires_at in leases:
+            target = self._target(shard, alive)
+            ours = owner == self.owner and lease_expires_at > now
+            if ours and target != self.worker:
+                release.append(shard)
+            elif ours or (lease_expires_at <= now and target == self.worker
+                          and (settled or shard % self.workers == self.worker)):
+                claim.append(shard)
+
+        held = set(storage.apply_leases(self.owner, claim, release, now, expires_at))
+        # A shard whose lease lapsed since the last round counts as gained when
+        # we win it back: owns() was False meanwhile, so its reminders must be reloaded
+        valid = {shard for shard, lease_expires_at in self._owned.items() if now < lease_expires_at - LEASE_MARGIN}
+        gained, lost = held - valid, set(self._owned) - held
+        self._owned = {shard: expires_at for shard in held}
+        if gained or lost:
+            logger.info("Worker %d now owns shards %s (gained %s, lost %s)",
+                        self.worker, sorted(held), sorted(gained), sorted(lost))
+        return gained, lost
+
+    # Function to give up every lease, so other workers can take over right away
+    def release_all(self):
+        storage.apply_leases(self.owner, [], list(self._owned), self.clock(), 0)
+        self._owned = {}
@@ -0,0 +1,551 @@
+import asyncio
+import sqlite3
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import metrics
+from migrations import ensure_reminders_schema
+
+logger = logging.getLogger(__name__)
+
+REMINDERS_DB_PATH = 'reminders.db'
+CHANNELS_DB_PATH = 'channels.db'
+
+# Maximum number of open connections per database file
+POOL_SIZE = 8
+# Seconds to wait for a free pooled connection, and for a locked database
+POOL_TIMEOUT = 10
+BUSY_TIMEOUT_MS = 5000
+# Per-connection LRU of compiled statements, keyed by SQL text
+STATEMENT_CACHE_SIZE = 256
+# Ids per query when looking up a batch of reminders (SQLite variable limit)
+ID_BATCH_SIZE = 500
+# Group commit: a batch holds at most this many writes, and stops gathering
+# after this many seconds even if writes keep streaming in
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_DELAY = 0.02
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+]
+
+CHANNELS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS channels
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, name TEXT)'''
+
+# In-progress conversations (see conversations.py), one row per user mid-flow
+CONVERSATIONS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS conversations
+                             (user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, text TEXT,
+                              updated_at INTEGER NOT NULL)'''
+
+# Shard leases and worker heartbeats of the multi-process mode (see sharding.py)
+SHARD_LEASES_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS shard_leases
+                            (shard INTEGER PRIMARY KEY, owner TEXT, expires_at REAL NOT NULL DEFAULT 0)'''
+SHARD_WORKERS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS shard_workers
+                             (worker INTEGER PRIMARY KEY, owner TEXT NOT NULL, seen_at REAL NOT NULL)'''
+
+# Time of the reads the bot makes per update or per scheduler tick, and of queued
+# writes from submit until their batch is committed
+DB_QUERY_SECONDS = metrics.registry.histogram('bot_db_query_seconds', "Time of a reminders query", ['query'])
+DB_WRITE_SECONDS = metrics.registry.histogram('bot_db_write_seconds', "Time from queueing a write until it is committed",
+                                              ['write'])
+DB_WRITE_BATCH_SECONDS = metrics.registry.histogram('bot_db_write_batch_seconds', "Time to execute and commit one write batch")
+
+# Statements are kept as constants so every call hits the statement cache
+SQL_INSERT_REMINDER = "INSERT INTO reminders (chat_id, text, due_at) VALUES (?, ?, ?)"
+SQL_INSERT_REPEATING_REMINDER = "INSERT INTO reminders (chat_id, text, due_at, repeat) VALUES (?, ?, ?, ?)"
+SQL_DELETE_REMINDER = "DELETE FROM reminders WHERE id = ?"
+SQL_SELECT_REMINDER = "SELECT chat_id, text, repeat FROM reminders WHERE id = ? AND acknowledged = 0"
+# Keyset pages of a chat's reminders in (due_at, id) order, served by idx_reminders_chat_page
+SQL_SELECT_CHAT_PAGE_FIRST = ("SELECT id, text, due_at, repeat FROM reminders WHERE chat_id = ? AND acknowledged = 0 "
+                              "ORDER BY due_at, id LIMIT ?")
+SQL_SELECT_CHAT_PAGE_AFTER = ("SELECT id, text, due_at, repeat FROM reminders WHERE chat_id = ? AND acknowledged = 0 "
+                              "AND (due_at, id) > (?, ?) ORDER BY due_at, id LIMIT ?")
+SQL_SELECT_CHAT_PAGE_BEFORE = ("SELECT id, text, due_at, repeat FROM reminders WHERE chat_id = ? AND acknowledged = 0 "
+                               "AND (due_at, id) < (?, ?) ORDER BY due_at DESC, id DESC LIMIT ?")
+SQL_SELECT_DUE_INDEX = "SELECT id, due_at FROM reminders WHERE fired = 0 AND acknowledged = 0"
+SQL_SELECT_DUE_INDEX_AFTER = "SELECT id, due_at FROM reminders WHERE id > ? AND fired = 0 AND acknowledged = 0"
+SQL_SELECT_MAX_REMINDER_ID = "SELECT COALESCE(MAX(id), 0) FROM reminders"
+SQL_SELECT_FOLLOW_UP_STATE = ("SELECT id, next_follow_up_at FROM reminders "
+                              "WHERE acknowledged = 0 AND next_follow_up_at IS NOT NULL")
+SQL_SELECT_FIRING_BATCH = ("SELECT id, chat_id, text, repeat FROM reminders "
+                           "WHERE id IN ({}) AND fired = 0 AND acknowledged = 0")
+SQL_SELECT_MISSED_BATCH = ("SELECT id, chat_id, text, due_at, repeat FROM reminders "
+                           "WHERE id IN ({}) AND fired = 0 AND acknowledged = 0")
+SQL_SELECT_FOLLOW_UP_BATCH = ("SELECT id, chat_id, text, follow_ups FROM reminders "
+                              "WHERE id IN ({}) AND acknowledged = 0 AND next_follow_up_at <= ?")
+# Firings keep the due time they were for and the time the message went out;
+# SET expressions see the row as it was, so fired_due_at gets the old due_at
+SQL_MARK_FIRED = ("UPDATE reminders SET fired = 1, follow_ups = 0, next_follow_up_at = ?, "
+                  "fired_due_at = due_at, fired_at = ? WHERE id = ?")
+# A repeating reminder stays unfired; it moves on to its next occurrence instead
+SQL_ADVANCE_REPEATING = ("UPDATE reminders SET due_at = ?, follow_ups = 0, next_follow_up_at = ?, "
+                         "fired_due_at = due_at, fired_at = ? WHERE id = ?")
+SQL_RESCHEDULE = "UPDATE reminders SET due_at = ? WHERE id = ?"
+# A one-off reminder too late to send is closed out: fired_due_at is set and
+# fired_at left NULL, as it was never sent
+SQL_MARK_MISSED = ("UPDATE reminders SET fired = 1, acknowledged = 1, next_follow_up_at = NULL, "
+                   "fired_due_at = due_at, fired_at = NULL WHERE id = ?")
+SQL_MARK_FOLLOW_UP = "UPDATE reminders SET follow_ups = follow_ups + 1, next_follow_up_at = ? WHERE id = ?"
+SQL_ACKNOWLEDGE = "UPDATE reminders SET acknowledged = 1, next_follow_up_at = NULL WHERE id = ?"
+SQL_STOP_FOLLOW_UPS = "UPDATE reminders SET next_follow_up_at = NULL WHERE id = ?"
+SQL_SAVE_CONVERSATION = ("INSERT OR REPLACE INTO conversations (user_id, state, text, updated_at) "
+                         "VALUES (?, ?, ?, ?)")
+SQL_DELETE_CONVERSATION = "DELETE FROM conversations WHERE user_id = ?"
+SQL_DELETE_EXPIRED_CONVERSATIONS = "DELETE FROM conversations WHERE updated_at <= ?"
+SQL_SELECT_CONVERSATIONS = "SELECT user_id, state, text, updated_at FROM conversations WHERE updated_at > ?"
+# Shard of a reminder's chat; SQLite's % keeps the sign, sharding.shard_of does not
+SQL_SHARD_OF = "(((chat_id % {count}) + {count}) % {count})"
+SQL_SELECT_SHARD_DUE_INDEX = ("SELECT id, due_at FROM reminders WHERE fired = 0 AND acknowledged = 0 "
+                              "AND " + SQL_SHARD_OF + " IN ({shards})")
+SQL_SELECT_SHARD_FOLLOW_UP_STATE = ("SELECT id, next_follow_up_at FROM reminders "
+                                    "WHERE acknowledged = 0 AND next_follow_up_at IS NOT NULL "
+                                    "AND " + SQL_SHARD_OF + " IN ({shards})")
+SQL_SELECT_NEW_REMINDERS = "SELECT id, chat_id, due_at FROM reminders WHERE id > ? AND fired = 0 AND acknowledged = 0"
+SQL_INSERT_SHARD = "INSERT OR IGNORE INTO shard_leases (shard) VALUES (?)"
+SQL_SAVE_HEARTBEAT = "INSERT OR REPLACE INTO shard_workers (worker, owner, seen_at) VALUES (?, ?, ?)"
+SQL_SELECT_LEASES = "SELECT shard, owner, expires_at FROM shard_leases WHERE shard < ? ORDER BY shard"
+SQL_SELECT_ALIVE_WORKERS = "SELECT worker FROM shard_workers WHERE seen_at > ?"
+# A lease is only taken if it is ours already or has expired, so two workers never both win it
+SQL_CLAIM_LEASE = "UPDATE shard_leases SET owner = ?, expires_at = ? WHERE shard = ? AND (owner = ? OR expires_at <= ?)"
+SQL_RELEASE_LEASE = "UPDATE shard_leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?"
+SQL_INSERT_CHANNEL = "INSERT INTO channels (chat_id, name) VALUES (?, ?)"
+SQL_DELETE_CHANNEL = "DELETE FROM channels WHERE id = ?"
+SQL_SELECT_CHANNELS = "SELECT id, name FROM channels"
+
+
+# Function to open a connection with the tuned pragmas applied
+def connect(path):
+    conn = sqlite3.connect(path, timeout=POOL_TIMEOUT, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# Bounded pool of SQLite connections shared by all dispatcher threads
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                return connect(self.path)
+        try:
+            return self._idle.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"No free connection to {self.path} after {POOL_TIMEOUT}s")
+
+    # Check out a connection; the transaction commits on success and rolls back on error
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+
+
+# Write-behind queue: handler threads enqueue statements and get a Future back,
+# a single writer thread executes them and commits once per batch
+class WriteBatcher:
+    def __init__(self, pool, max_batch=WRITE_BATCH_SIZE, max_delay=WRITE_BATCH_DELAY):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    # Queue a write; the Future resolves to the cursor's lastrowid after commit
+    def submit(self, sql, params=()):
+        future = Future()
+        self._queue.put((sql, params, future))
+        return future
+
+    # Flush everything queued so far and stop the writer thread
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            stopping = False
+            # Take whatever queued up while the previous batch was committing. The batch
+            # closes as soon as the queue runs dry, so a lone write is never held back
+            while len(batch) < self.max_batch and time.monotonic() < deadline:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch):
+        results = []
+        start = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                for sql, params, future in batch:
+                    # A failing statement is rolled back on its own, the rest of the batch still commits
+                    try:
+                        results.append((future, conn.execute(sql, params).lastrowid, None))
+                    except sqlite3.Error as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.exception("Write batch of %d statements failed", len(batch))
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        DB_WRITE_BATCH_SECONDS.observe(time.perf_counter() - start)
+        self.batches += 1
+        self.writes += len(batch)
+        for future, lastrowid, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(lastrowid)
+
+
+_reminders_pool = None
+_channels_pool = None
+_reminders_writer = None
+# Dedicated threads for blocking SQLite calls made from the event loop
+_db_executor = None
+
+
+# Function to open the pools and set up the schema, once at startup
+def init_storage(reminders_path=REMINDERS_DB_PATH, channels_path=CHANNELS_DB_PATH, pool_size=POOL_SIZE,
+                 batch_writes=True):
+    global _reminders_pool, _channels_pool, _reminders_writer, _db_executor
+    _reminders_pool = ConnectionPool(reminders_path, pool_size)
+    _channels_pool = ConnectionPool(channels_path, pool_size)
+    _db_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='sqlite')
+
+    with _reminders_pool.connection() as conn:
+        ensure_reminders_schema(conn)
+        conn.execute(CONVERSATIONS_TABLE_SQL)
+        conn.execute(SHARD_LEASES_TABLE_SQL)
+        conn.execute(SHARD_WORKERS_TABLE_SQL)
+    with _channels_pool.connection() as conn:
+        conn.execute(CHANNELS_TABLE_SQL)
+
+    if batch_writes:
+        _reminders_writer = WriteBatcher(_reminders_pool)
+        _reminders_writer.start()
+    logger.info("Storage ready (%s, %s)", reminders_path, channels_path)
+
+
+# Function to flush pending writes and close every pooled connection
+def close_storage():
+    global _reminders_writer, _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown()
+        _db_executor = None
+    if _reminders_writer is not None:
+        _reminders_writer.stop()
+        _reminders_writer = None
+    for pool in (_reminders_pool, _channels_pool):
+        if pool is not None:
+            pool.close()
+
+
+# Function to run a blocking storage call on the SQLite executor from the event loop
+async def run_db(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, fn, *args)
+
+
+# Function to run fn(conn, *args) on a pooled reminders connection, for bulk jobs
+# that manage their own transactions
+def with_reminders_connection(fn, *args):
+    with _reminders_pool.connection() as conn:
+        return fn(conn, *args)
+
+
+# Function to wait for a queued write from the event loop without blocking it
+async def wait_for_write(future):
+    return await asyncio.wrap_future(future)
+
+
+# Function to run a reminders write through the group-commit writer when it is running,
+# or inline otherwise; either way the caller gets a Future. `name` labels its timing.
+def _write_reminders(name, sql, params):
+    start = time.perf_counter()
+    series = DB_WRITE_SECONDS.labels(name)
+    if _reminders_writer is not None:
+        future = _reminders_writer.submit(sql, params)
+        future.add_done_callback(lambda f: series.observe(time.perf_counter() - start))
+        return future
+    future = Future()
+    future.add_done_callback(lambda f: series.observe(time.perf_counter() - start))
+    try:
+        with _reminders_pool.connection() as conn:
+            future.set_result(conn.execute(sql, params).lastrowid)
+    except sqlite3.Error as e:
+        future.set_exception(e)
+    return future
+
+
+# Reminders
+
+# Returns a Future that resolves to the new reminder id once committed
+def add_reminder(chat_id, text, due_at, repeat=None):
+    if repeat is None:
+        return _write_reminders('add_reminder', SQL_INSERT_REMINDER, (chat_id, text, due_at))
+    return _write_reminders('add_reminder', SQL_INSERT_REPEATING_REMINDER, (chat_id, text, due_at, repeat))
+
+
+# Returns a Future that resolves once the delete is committed
+def delete_reminder(reminder_id):
+    return _write_reminders('delete_reminder', SQL_DELETE_REMINDER, (reminder_id,))
+
+
+# Returns a Future that resolves once the first firing is recorded; `fired_at` is when it was sent
+def mark_fired(reminder_id, next_follow_up_at, fired_at):
+    return _write_reminders('mark_fired', SQL_MARK_FIRED, (next_follow_up_at, fired_at, reminder_id))
+
+
+# Returns a Future that resolves once a repeating reminder has moved on to its next occurrence
+def advance_repeating(reminder_id, due_at, next_follow_up_at, fired_at):
+    return _write_reminders('advance_repeating', SQL_ADVANCE_REPEATING,
+                            (due_at, next_follow_up_at, fired_at, reminder_id))
+
+
+# Returns a Future that resolves once the new due time is recorded
+def reschedule_reminder(reminder_id, due_at):
+    return _write_reminders('reschedule_reminder', SQL_RESCHEDULE, (due_at, reminder_id))
+
+
+# Returns a Future that resolves once a missed one-off reminder is recorded
+def mark_missed(reminder_id):
+    return _write_reminders('mark_missed', SQL_MARK_MISSED, (reminder_id,))
+
+
+# Returns a Future that resolves once the follow-up is recorded
+def mark_follow_up(reminder_id, next_follow_up_at):
+    return _write_reminders('mark_follow_up', SQL_MARK_FOLLOW_UP, (next_follow_up_at, reminder_id))
+
+
+# Returns a Future that resolves once the reminder is marked done
+def acknowledge_reminder(reminder_id):
+    return _write_reminders('acknowledge_reminder', SQL_ACKNOWLEDGE, (reminder_id,))
+
+
+# Returns a Future that resolves once the current occurrence of a repeating reminder is done
+def stop_follow_ups(reminder_id):
+    return _write_reminders('stop_follow_ups', SQL_STOP_FOLLOW_UPS, (reminder_id,))
+
+
+@metrics.timed(DB_QUERY_SECONDS, 'get_reminder')
+def get_reminder(reminder_id):
+    with _reminders_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_REMINDER, (reminder_id,)).fetchone()
+
+
+# One page of a chat's reminders. `cursor` is None for the first page, or
+# ('next' or 'prev', due_at, id) of the row the page starts after or ends before.
+# Returns (rows, has_prev, has_next); rows are always in (due_at, id) order.
+@metrics.timed(DB_QUERY_SECONDS, 'get_reminder_page')
+def get_reminder_page(chat_id, cursor=None, limit=10):
+    with _reminders_pool.connection() as conn:
+        if cursor is None:
+            rows = conn.execute(SQL_SELECT_CHAT_PAGE_FIRST, (chat_id, limit + 1)).fetchall()
+            return rows[:limit], False, len(rows) > limit
+        direction, due_at, reminder_id = cursor
+        if direction == 'next':
+            rows = conn.execute(SQL_SELECT_CHAT_PAGE_AFTER, (chat_id, due_at, reminder_id, limit + 1)).fetchall()
+            return rows[:limit], True, len(rows) > limit
+        rows = conn.execute(SQL_SELECT_CHAT_PAGE_BEFORE, (chat_id, due_at, reminder_id, limit + 1)).fetchall()
+        return rows[:limit][::-1], len(rows) > limit, True
+
+
+@metrics.timed(DB_QUERY_SECONDS, 'get_due_index')
+def get_due_index():
+    with _reminders_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_DUE_INDEX).fetchall()
+
+
+# Pending reminders added after the given id, e.g. by a bulk import
+def get_due_index_after(reminder_id):
+    with _reminders_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_DUE_INDEX_AFTER, (reminder_id,)).fetchall()
+
+
+def get_max_reminder_id():
+    with _reminders_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_MAX_REMINDER_ID).fetchone()[0]
+
+
+# Reminders that have fired but are not acknowledged yet, with their next follow-up time
+def get_follow_up_state():
+    with _reminders_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_FOLLOW_UP_STATE).fetchall()
+
+
+# Of the given reminder ids, the ones whose follow-up is still wanted at `now`
+@metrics.timed(DB_QUERY_SECONDS, 'get_follow_up_batch')
+def get_follow_up_batch(reminder_ids, now):
+    rows = []
+    with _reminders_pool.connection() as conn:
+        for start in range(0, len(reminder_ids), ID_BATCH_SIZE):
+            chunk = list(reminder_ids[start:start + ID_BATCH_SIZE])
+            sql = SQL_SELECT_FOLLOW_UP_BATCH.format(','.join('?' * len(chunk)))
+            rows.extend(conn.execute(sql, chunk + [now]).fetchall())
+    return rows
+
+
+# Reminders the firing engine found due, if they are still pending: (id, chat_id, text, repeat)
+@metrics.timed(DB_QUERY_SECONDS, 'get_firing_batch')
+def get_firing_batch(reminder_ids):
+    rows = []
+    with _reminders_pool.connection() as conn:
+        for start in range(0, len(reminder_ids), ID_BATCH_SIZE):
+            chunk = list(reminder_ids[start:start + ID_BATCH_SIZE])
+            sql = SQL_SELECT_FIRING_BATCH.format(','.join('?' * len(chunk)))
+            rows.extend(conn.execute(sql, chunk).fetchall())
+    return rows
+
+
+# Of the given reminder ids, the pending ones: (id, chat_id, text, due_at, repeat)
+@metrics.timed(DB_QUERY_SECONDS, 'get_missed_batch')
+def get_missed_batch(reminder_ids):
+    rows = []
+    with _reminders_pool.connection() as conn:
+        for start in range(0, len(reminder_ids), ID_BATCH_SIZE):
+            chunk = list(reminder_ids[start:start + ID_BATCH_SIZE])
+            sql = SQL_SELECT_MISSED_BATCH.format(','.join('?' * len(chunk)))
+            rows.extend(conn.execute(sql, chunk).fetchall())
+    return rows
+
+
+# Shards
+
+# Pending reminders of the given shards, for a worker that just took them over
+def get_shard_due_index(shards, count):
+    sql = SQL_SELECT_SHARD_DUE_INDEX.format(count=int(count), shards=','.join(str(int(shard)) for shard in shards))
+    with _reminders_pool.connection() as conn:
+        return conn.execute(sql).fetchall()
+
+
+def get_shard_follow_up_state(shards, count):
+    sql = SQL_SELECT_SHARD_FOLLOW_UP_STATE.format(count=int(count), shards=','.join(str(int(shard)) for shard in shards))
+    with _reminders_pool.connection() as conn:
+        return conn.execute(sql).fetchall()
+
+
+# Pending reminders added after the given id, with their chat, e.g. by the ingress process
+@metrics.timed(DB_QUERY_SECONDS, 'get_new_reminders')
+def get_new_reminders(reminder_id):
+    with _reminders_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_NEW_REMINDERS, (reminder_id,)).fetchall()
+
+
+# Function to record a worker's heartbeat and read the lease table.
+# Returns ([(shard, owner, expires_at)], set of live worker indexes).
+def lease_round(worker, owner, count, now, ttl):
+    with _reminders_pool.connection() as conn:
+        conn.executemany(SQL_INSERT_SHARD, ((shard,) for shard in range(count)))
+        conn.execute(SQL_SAVE_HEARTBEAT, (worker, owner, now))
+        conn.commit()
+        leases = conn.execute(SQL_SELECT_LEASES, (count,)).fetchall()
+        alive = {row[0] for row in conn.execute(SQL_SELECT_ALIVE_WORKERS, (now - ttl,))}
+    return leases, alive
+
+
+# Function to claim or renew leases until expires_at and give up others.
+# Returns the claimed shards that were actually won.
+def apply_leases(owner, claim, release, now, expires_at):
+    won = []
+    with _reminders_pool.connection() as conn:
+        for shard in claim:
+            if conn.execute(SQL_CLAIM_LEASE, (owner, expires_at, shard, owner, now)).rowcount:
+                won.append(shard)
+        conn.executemany(SQL_RELEASE_LEASE, ((shard, owner) for shard in release))
+    return won
+
+
+# Conversations
+
+# Returns a Future that resolves once the conversation is saved
+def save_conversation(user_id, state, text, updated_at):
+    return _write_reminders('save_conversation', SQL_SAVE_CONVERSATION, (user_id, state, text, updated_at))
+
+
+def delete_conversation(user_id):
+    return _write_reminders('delete_conversation', SQL_DELETE_CONVERSATION, (user_id,))
+
+
+def delete_expired_conversations(cutoff):
+    return _write_reminders('delete_expired_conversations', SQL_DELETE_EXPIRED_CONVERSATIONS, (cutoff,))
+
+
+# Conversations updated after `since`
+def get_conversations(since):
+    with _reminders_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_CONVERSATIONS, (since,)).fetchall()
+
+
+# Channels
+
+def save_channel(chat_id, channel_link):
+    with _channels_pool.connection() as conn:
+        conn.execute(SQL_INSERT_CHANNEL, (chat_id, channel_link))
+
+
+def remove_channel(channel_id):
+    with _channels_pool.connection() as conn:
+        conn.execute(SQL_DELETE_CHANNEL, (channel_id,))
+
+
+def get_channels():
+    with _channels_pool.connection() as conn:
+        return conn.execute(SQL_SELECT_CHANNELS).fetchall()
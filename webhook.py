@@ -0,0 +1,239 @@
+import asyncio
+import hmac
+import json
+import logging
+import time
+from collections import deque
+import metrics
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Where the webhook server listens. Telegram only posts to HTTPS on ports
+# 443, 80, 88 and 8443, so run a TLS-terminating proxy in front of it.
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = '/webhook'
+
+# Updates accepted but not handled yet. Past this the server answers 503 and
+# Telegram delivers the update again later, so memory stays bounded under overload.
+MAX_PENDING_UPDATES = 1000
+# Tasks handling updates; each chat is handled by one of them at a time
+WEBHOOK_WORKERS = 32
+# Telegram updates are a few KiB at most
+MAX_BODY_SIZE = 1 << 20
+
+UPDATE_WAIT_SECONDS = metrics.registry.histogram('bot_webhook_queue_wait_seconds',
+                                                 "Time an update waits between arriving and being handled")
+WEBHOOK_REQUESTS = metrics.registry.counter('bot_webhook_requests_total', "Webhook requests by outcome", ['result'])
+
+REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 503: 'Service Unavailable'}
+
+
+# Function to pick the key updates are ordered by: the chat, else the user.
+# Updates without either (e.g. polls) have no order to keep.
+def ordering_key(update):
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return ('update', update.update_id)
+
+
+# Bounded queue that hands updates to `workers` tasks calling `handle(update)`,
+# or awaiting the coroutine queued with the update. Updates of one chat are
+# handled one after another in arrival order; different chats run in parallel.
+# A chat with more updates waiting goes to the back of the line after each one,
+# so one busy chat cannot hold up the others.
+class ChatOrderedQueue:
+    def __init__(self, handle, workers=WEBHOOK_WORKERS, max_pending=MAX_PENDING_UPDATES, clock=time.monotonic):
+        self.handle = handle
+        self.workers = workers
+        self.max_pending = max_pending
+        self.clock = clock
+        self.pending = 0
+        self.max_depth = 0
+        # key -> deque of (queued_at, update, coroutine); present while the chat has updates queued or running
+        self._chats = {}
+        # Keys whose next update can start, each at most once
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.get_running_loop().create_task(self._work(), name=f'webhook-worker-{i}')
+                       for i in range(self.workers)]
+
+    # Function to queue an update; returns False when full
+    def put(self, update, coroutine=None):
+        if self.pending >= self.max_pending:
+            return False
+        self.pending += 1
+        self.max_depth = max(self.max_depth, self.pending)
+        self._idle.clear()
+        key = ordering_key(update)
+        queued = self._chats.get(key)
+        if queued is None:
+            self._chats[key] = deque([(self.clock(), update, coroutine)])
+            self._ready.put_nowait(key)
+        else:
+            queued.append((self.clock(), update, coroutine))
+        return True
+
+    # Finish every queued update, then stop the worker tasks
+    async def stop(self):
+        await self._idle.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self):
+        while True:
+            key = await self._ready.get()
+            queued = self._chats[key]
+            queued_at, update, coroutine = queued.popleft()
+            UPDATE_WAIT_SECONDS.observe(self.clock() - queued_at)
+            try:
+                await (coroutine if coroutine is not None else self.handle(update))
+            except Exception:
+                logger.exception("Error handling update %s", update.update_id)
+            finally:
+                self.pending -= 1
+                if queued:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+                if not self.pending:
+                    self._idle.set()
+
+
+# Update processor for polling mode that keeps each chat's updates in order, like
+# the webhook does. PTB's semaphore caps the updates queued or running at
+# `max_pending`, so the queue is never full; `workers` of them run at once.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, workers=WEBHOOK_WORKERS, max_pending=MAX_PENDING_UPDATES):
+        super().__init__(max_pending)
+        self.workers = workers
+        self.queue = None
+
+    async def initialize(self):
+        self.queue = ChatOrderedQueue(None, self.workers, self.max_concurrent_updates)
+        self.queue.start()
+
+    async def shutdown(self):
+        if self.queue is not None:
+            await self.queue.stop()
+            self.queue = None
+
+    # Wait until the update's turn in its chat has come and gone, so PTB's
+    # stop() still waits for every update it fetched
+    async def do_process_update(self, update, coroutine):
+        if not isinstance(update, Update):
+            await coroutine
+            return
+        done = asyncio.get_running_loop().create_future()
+
+        async def run():
+            try:
+                await coroutine
+            finally:
+                if not done.done():
+                    done.set_result(None)
+
+        self.queue.put(update, run())
+        await done
+
+
+# Embedded HTTP/1.1 server Telegram posts updates to. Each update is answered
+# as soon as it is queued; a full queue answers 503 so Telegram retries it later.
+# With `secret_token`, requests must carry it in X-Telegram-Bot-Api-Secret-Token.
+class WebhookServer:
+    def __init__(self, application, path=WEBHOOK_PATH, secret_token=None,
+                 workers=WEBHOOK_WORKERS, max_pending=MAX_PENDING_UPDATES):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.queue = ChatOrderedQueue(application.process_update, workers, max_pending)
+        self.port = None
+        self._server = None
+        # writer -> task handling the connection
+        self._connections = {}
+
+    async def start(self, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        self.queue.start()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("Webhook on http://%s:%d%s", host, self.port, self.path)
+        return self
+
+    # Stop accepting updates, then finish the ones already accepted
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        # Every accepted update has been answered; idle keep-alive connections can go
+        tasks = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.queue.stop()
+
+    def _respond(self, method, path, headers, body):
+        if path != self.path:
+            return 404, 'not_found'
+        if method != 'POST':
+            return 405, 'bad_method'
+        if self.secret_token is not None and not hmac.compare_digest(
+                headers.get('x-telegram-bot-api-secret-token', '').encode(), self.secret_token.encode()):
+            return 403, 'forbidden'
+        try:
+            data = json.loads(body)
+            # de_json expects an object and fails in odd ways on anything else
+            if not isinstance(data, dict):
+                return 400, 'bad_update'
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return 400, 'bad_update'
+        if update is None:
+            return 400, 'bad_update'
+        if not self.queue.put(update):
+            return 503, 'shed'
+        return 200, 'accepted'
+
+    async def _handle_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        try:
+            # Telegram keeps connections open and sends one update per request
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_SIZE:
+                    status, result = 413, 'too_large'
+                else:
+                    status, result = self._respond(method, target.split('?', 1)[0], headers,
+                                                   await reader.readexactly(length))
+                WEBHOOK_REQUESTS.labels(result).inc()
+                retry = b'Retry-After: 1\r\n' if status == 503 else b''
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Length: 0\r\n%s\r\n' % (status, REASONS[status].encode(), retry))
+                await writer.drain()
+                if status == 413:
+                    break
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()